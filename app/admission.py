@@ -0,0 +1,190 @@
+"""
+Контроль допуска запросов и сброс нагрузки по емкости пула БД
+
+Каждый запрос к /books и /categories сначала занимает место в лимите своего
+маршрута, затем - в общем лимите, равном емкости пула соединений
+(DB_POOL_SIZE + DB_MAX_OVERFLOW) за вычетом соединений фоновой работы
+того же процесса: исполнителей задач (JOB_WORKERS), потока обновления
+статистики категорий и журнала медленных запросов (если включен). Если мест нет, запрос ждет в ограниченной
+очереди; дешевые запросы (книга или категория по ID) обслуживаются раньше
+дорогих (поиск). Если очередь заполнена или ожидание затянулось, запрос
+сразу получает 503 с заголовком Retry-After вместо 30 секунд ожидания пула.
+
+Настройки через переменные окружения:
+    ADMISSION_QUEUE_SIZE    - длина очереди ожидания (по умолчанию 2 x емкость пула)
+    ADMISSION_WAIT_TIMEOUT  - максимальное ожидание в очереди, секунды (по умолчанию 5)
+    ADMISSION_RETRY_AFTER   - значение Retry-After, секунды (по умолчанию 1)
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from app.db.db import DB_POOL_SIZE, DB_MAX_OVERFLOW
+from app.db.slow_query import SLOW_QUERY_MS
+from app.jobs import JOB_WORKERS
+
+# Фоновые потоки берут соединения из того же пула, что и запросы
+BACKGROUND_CONNECTIONS = JOB_WORKERS + 1 + (1 if SLOW_QUERY_MS else 0)
+POOL_CAPACITY = max(1, DB_POOL_SIZE + DB_MAX_OVERFLOW - BACKGROUND_CONNECTIONS)
+QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", str(POOL_CAPACITY * 2)))
+WAIT_TIMEOUT = float(os.getenv("ADMISSION_WAIT_TIMEOUT", "5"))
+RETRY_AFTER = os.getenv("ADMISSION_RETRY_AFTER", "1")
+
+# (метод, шаблон пути, имя маршрута, приоритет, доля емкости пула)
+# Меньший приоритет обслуживается раньше
+ROUTES: List[Tuple[str, "re.Pattern", str, int, float]] = [
+    ("GET", re.compile(r"^/books/search/?$"), "search_books", 2, 1 / 3),
+    ("GET", re.compile(r"^/books/\d+/?$"), "read_book", 0, 1.0),
+    ("GET", re.compile(r"^/categories/\d+/?$"), "read_category", 0, 1.0),
+    ("GET", re.compile(r"^/(books|categories)/?$"), "list", 1, 1.0),
+    ("*", re.compile(r"^/(books|categories)(/.*)?$"), "other", 1, 1.0),
+]
+
+_middleware: Optional["AdmissionControlMiddleware"] = None
+
+
+class PriorityLimiter:
+    """Ограничитель параллельности с ограниченной очередью по приоритетам"""
+
+    def __init__(self, capacity: int, max_waiting: int):
+        self.capacity = max(1, capacity)
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.rejected = 0
+        self._waiters: list = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int = 0, timeout: Optional[float] = None) -> bool:
+        """
+        Занимает место
+
+        Args:
+            priority: Приоритет (меньше - раньше)
+            timeout: Максимальное ожидание в секундах
+
+        Returns:
+            bool: True если место получено, False если очередь полна или вышло время
+        """
+        if self.active < self.capacity and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_waiting:
+            self.rejected += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._counter), future]
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._discard(entry)
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            self._discard(entry)
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        """Освобождает место, передавая его первому ожидающему"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active -= 1
+
+    def _discard(self, entry: list):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware контроля допуска"""
+
+    def __init__(self, app, capacity: int = POOL_CAPACITY, queue_size: int = QUEUE_SIZE):
+        self.app = app
+        self.limiter = PriorityLimiter(capacity, queue_size)
+        self.route_limiters: Dict[str, PriorityLimiter] = {
+            name: PriorityLimiter(max(1, int(capacity * share)), queue_size)
+            for _, _, name, _, share in ROUTES
+        }
+        global _middleware
+        _middleware = self
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = classify_route(scope["method"], scope["path"])
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        name, priority = route
+        route_limiter = self.route_limiters[name]
+        if not await route_limiter.acquire(priority, WAIT_TIMEOUT):
+            await self._reject(scope, receive, send)
+            return
+        try:
+            if not await self.limiter.acquire(priority, WAIT_TIMEOUT):
+                await self._reject(scope, receive, send)
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.limiter.release()
+        finally:
+            route_limiter.release()
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse(
+            status_code=503,
+            content={"detail": "Сервис перегружен, повторите запрос позже"},
+            headers={"Retry-After": RETRY_AFTER},
+        )
+        await response(scope, receive, send)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Возвращает состояние общего лимита и лимитов маршрутов"""
+        result = {"total": self.limiter.stats()}
+        for name, limiter in self.route_limiters.items():
+            result[name] = limiter.stats()
+        return result
+
+
+def classify_route(method: str, path: str) -> Optional[Tuple[str, int]]:
+    """
+    Определяет маршрут и приоритет запроса
+
+    Returns:
+        tuple: (имя маршрута, приоритет) или None, если запрос не ограничивается
+    """
+    for route_method, pattern, name, priority, _ in ROUTES:
+        if route_method in ("*", method) and pattern.match(path):
+            return name, priority
+    return None
+
+
+def get_admission_stats() -> Dict[str, Dict[str, int]]:
+    """Возвращает состояние контроля допуска в текущем процессе"""
+    if _middleware is None:
+        return {}
+    return _middleware.stats()
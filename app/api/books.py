@@ -1,5 +1,6 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Request
+from fastapi.responses import JSONResponse
+from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session  
 
 from app.db.crud import (
@@ -8,12 +9,19 @@ from app.db.crud import (
     create_book,
     update_book,
     delete_book,
-    get_books_by_category,
     get_category,
-    search_books  
+    get_similar_books
 )
+from app.db.coalescing import (
+    get_book_coalesced,
+    get_books_by_category_coalesced,
+    search_books_coalesced
+)
+from app.db.group_commit import create_book_grouped, group_commit_enabled
+from app.db.breaker import DATABASE_UNAVAILABLE_ERRORS
 from app.db.db import get_db
-from app.schemas import BookResponse, BookCreate, BookUpdate
+from app.encoding import encode_response
+from app.schemas import BookResponse, BookCreate, BookUpdate, parse_book_fields, book_fields_schema
 
 router = APIRouter(
     prefix="/books",
@@ -21,14 +29,34 @@ router = APIRouter(
     responses={404: {"description": "Книга не найдена"}}
 )
 
+FIELDS_DESCRIPTION = "Возвращаемые поля через запятую, например id,title,price"
+
+def get_book_fields(
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+) -> Optional[Tuple[str, ...]]:
+    """Зависимость: разбирает параметр ?fields="""
+    try:
+        return parse_book_fields(fields)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
 @router.get("/", response_model=List[BookResponse])
 async def read_books(
+    request: Request,
     category_id: Optional[int] = Query(None, description="Фильтр по ID категории"),
+    subtree: bool = Query(False, description="Включить книги всех подкатегорий category_id"),
+    fields: Optional[Tuple[str, ...]] = Depends(get_book_fields),
     db: Session = Depends(get_db)  
 ):
     """
     Получить список всех книг.
     Можно фильтровать по категории через параметр category_id
+    (с subtree=true - по категории вместе с подкатегориями),
+    набор полей ограничивается параметром fields.
+    Формат ответа выбирается заголовками Accept и Accept-Encoding
     """
     try:
         if category_id is not None:
@@ -39,16 +67,22 @@ async def read_books(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Категория с ID {category_id} не найдена"
                 )
-            books = get_books_by_category(db, category_id)  
+            # Общее чтение берет свое соединение: соединение запроса возвращается
+            # в пул до ожидания, иначе запрос держал бы два соединения сразу
+            db.close()
+            books = await get_books_by_category_coalesced(category_id, fields, subtree)
         else:
-            books = get_all_books(db)  
+            books = get_all_books(db, fields=fields)
         
         if books is None:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Ошибка при получении списка книг"
             )
-        return books
+        schema = book_fields_schema(fields) if fields else BookResponse
+        return await encode_response(request, books, schema)
+    except (HTTPException,) + DATABASE_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         print(f"Ошибка в read_books: {e}")
         raise HTTPException(
@@ -59,19 +93,39 @@ async def read_books(
 @router.get("/{book_id}", response_model=BookResponse)
 async def read_book(
     book_id: int, 
+    fields: Optional[Tuple[str, ...]] = Depends(get_book_fields),
     db: Session = Depends(get_db)  
 ):
     """
-    Получить книгу по ID
+    Получить книгу по ID (набор полей ограничивается параметром fields)
     """
-    book = get_book(db, book_id)  
+    book = await get_book_coalesced(book_id, fields)
     if book is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Книга с ID {book_id} не найдена"
         )
+    if fields:
+        return JSONResponse(book_fields_schema(fields).model_validate(book).model_dump(mode="json"))
     return book
 
+@router.get("/{book_id}/similar", response_model=List[BookResponse])
+async def read_similar_books(
+    book_id: int,
+    limit: int = Query(10, ge=1, le=50, description="Максимальное число похожих книг"),
+    db: Session = Depends(get_db)
+):
+    """
+    Получить похожие книги (рассчитываются заранее командой python -m app.similarity)
+    """
+    books = get_similar_books(db, book_id, limit)
+    if books is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Книга с ID {book_id} не найдена"
+        )
+    return books
+
 @router.post("/", response_model=BookResponse, status_code=status.HTTP_201_CREATED)
 async def create_new_book(
     book: BookCreate, 
@@ -86,6 +140,8 @@ async def create_new_book(
     - **price**: Цена (обязательно)
     - **url**: Ссылка на товар
     - **category_id**: ID категории (может быть null)
+    
+    При BOOKS_GROUP_COMMIT_MS > 0 одновременные вставки фиксируются пачками
     """
    
     if not book.title.strip():
@@ -109,14 +165,26 @@ async def create_new_book(
                 detail=f"Категория с ID {book.category_id} не найдена"
             )
     
-    new_book = create_book(
-        db=db,  
-        title=book.title,
-        description=book.description,
-        price=book.price,
-        category_id=book.category_id,
-        url=book.url or ''
-    )
+    if group_commit_enabled():
+        # Пачка фиксируется в своей сессии: соединение запроса нужно вернуть
+        # в пул до ожидания, иначе при занятом пуле пачке не хватит соединения
+        db.close()
+        new_book = await create_book_grouped(
+            title=book.title,
+            description=book.description,
+            price=book.price,
+            category_id=book.category_id,
+            url=book.url or ''
+        )
+    else:
+        new_book = create_book(
+            db=db,  
+            title=book.title,
+            description=book.description,
+            price=book.price,
+            category_id=book.category_id,
+            url=book.url or ''
+        )
     
     if new_book is None:
         raise HTTPException(
@@ -222,16 +290,20 @@ async def delete_existing_book(
 
 @router.get("/search/", response_model=List[BookResponse])
 async def search_books_endpoint(
+    request: Request,
     q: str = Query(..., min_length=2, description="Поисковый запрос"),
+    fields: Optional[Tuple[str, ...]] = Depends(get_book_fields),
     db: Session = Depends(get_db)  
 ):
     """
-    Поиск книг по названию или описанию
+    Поиск книг по названию или описанию (набор полей ограничивается параметром fields).
+    Формат ответа выбирается заголовками Accept и Accept-Encoding
     """
-    books = search_books(db, q)  
+    books = await search_books_coalesced(q, fields)
     if books is None:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Ошибка при поиске книг"
         )
-    return books
\ No newline at end of file
+    schema = book_fields_schema(fields) if fields else BookResponse
+    return await encode_response(request, books, schema)
\ No newline at end of file
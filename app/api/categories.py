@@ -1,10 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, status, Request, Query
+from typing import List, Optional
+from datetime import datetime, timezone
 from sqlalchemy.orm import Session
 
-from app.db.crud import get_all_categories, get_category, create_category, update_category, delete_category
+from app.db.crud import (
+    get_all_categories,
+    get_category,
+    create_category,
+    update_category,
+    delete_category,
+    get_category_stats,
+    get_subtree_book_counts,
+    move_category_subtree,
+    create_job
+)
 from app.db.db import get_db
-from app.schemas import CategoryResponse, CategoryCreate, CategoryUpdate
+from app.db.models import BOOKS_PARTITIONING
+from app.jobs import JobQueueFull, submit_job
+from app.encoding import encode_response
+from app.schemas import CategoryResponse, CategoryCreate, CategoryUpdate, CategoryMove, CategoryStatsResponse, CategoryTreeNode
 
 router = APIRouter(
     prefix="/categories",
@@ -12,11 +26,41 @@ router = APIRouter(
     responses={404: {"description": "Категория не найдена"}}
 )
 
+def schedule_partition_sync(db: Session):
+    """В режиме BOOKS_PARTITIONING=list ставит в очередь синхронизацию секций books"""
+    if BOOKS_PARTITIONING != "list":
+        return
+    job = create_job(db, "partition_sync")
+    if job is None:
+        return
+    try:
+        submit_job(job.id)
+    except (JobQueueFull, RuntimeError):
+        # Задача останется pending и будет подобрана восстановлением задач
+        pass
+
 @router.get("/", response_model=List[CategoryResponse])
-async def read_categories(db: Session = Depends(get_db)):
-    """Получить список всех категорий"""
+async def read_categories(request: Request, db: Session = Depends(get_db)):
+    """Получить список всех категорий (формат - по заголовкам Accept и Accept-Encoding)"""
     categories = get_all_categories(db)
-    return categories
+    return await encode_response(request, categories, CategoryResponse)
+
+@router.get("/stats", response_model=CategoryStatsResponse)
+async def read_category_stats(db: Session = Depends(get_db)):
+    """
+    Статистика цен по категориям (мин., макс., средняя, медиана, 90-й перцентиль, число книг).
+    Данные берутся из периодически обновляемого представления, age_seconds - их возраст
+    """
+    rows = get_category_stats(db)
+    refreshed_at = rows[0]["refreshed_at"] if rows else None
+    age_seconds = None
+    if refreshed_at is not None:
+        age_seconds = (datetime.now(timezone.utc) - refreshed_at).total_seconds()
+    return CategoryStatsResponse(
+        refreshed_at=refreshed_at,
+        age_seconds=age_seconds,
+        categories=rows
+    )
 
 @router.get("/{category_id}", response_model=CategoryResponse)
 async def read_category(category_id: int, db: Session = Depends(get_db)):
@@ -29,21 +73,42 @@ async def read_category(category_id: int, db: Session = Depends(get_db)):
         )
     return category
 
+@router.get("/{category_id}/subtree", response_model=List[CategoryTreeNode])
+async def read_category_subtree(category_id: int, db: Session = Depends(get_db)):
+    """
+    Получить категорию и все ее подкатегории с числом книг:
+    books_count - в самой категории, subtree_books_count - вместе с подкатегориями
+    """
+    rows = get_subtree_book_counts(db, category_id)
+    if not rows:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Категория с ID {category_id} не найдена"
+        )
+    return rows
+
 @router.post("/", response_model=CategoryResponse, status_code=status.HTTP_201_CREATED)
 async def create_new_category(category: CategoryCreate, db: Session = Depends(get_db)):
-    """Создать новую категорию"""
+    """Создать новую категорию (parent_id - ID родительской категории)"""
     if not category.title.strip():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Название категории не может быть пустым"
         )
     
-    new_category = create_category(db, category.title)
+    if category.parent_id is not None and get_category(db, category.parent_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Категория с ID {category.parent_id} не найдена"
+        )
+    
+    new_category = create_category(db, category.title, category.parent_id)
     if not new_category:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Категория с таким названием уже существует"
         )
+    schedule_partition_sync(db)
     return new_category
 
 @router.put("/{category_id}", response_model=CategoryResponse)
@@ -67,13 +132,62 @@ async def update_existing_category(
         )
     return updated_category
 
+@router.post("/{category_id}/move", response_model=CategoryResponse)
+async def move_category(category_id: int, move: CategoryMove, db: Session = Depends(get_db)):
+    """Перенести категорию вместе с подкатегориями под другого родителя (parent_id: null - в корень)"""
+    if get_category(db, category_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Категория с ID {category_id} не найдена"
+        )
+    if move.parent_id is not None:
+        if get_category(db, move.parent_id) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Категория с ID {move.parent_id} не найдена"
+            )
+    
+    try:
+        moved = move_category_subtree(db, category_id, move.parent_id)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if moved is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка при переносе категории"
+        )
+    return moved
+
 @router.delete("/{category_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_existing_category(category_id: int, db: Session = Depends(get_db)):
-    """Удалить категорию"""
-    deleted = delete_category(db, category_id)
+async def delete_existing_category(
+    category_id: int,
+    move_to: Optional[int] = Query(None, description="ID категории, в которую перенести книги перед удалением"),
+    db: Session = Depends(get_db)
+):
+    """
+    Удалить категорию (книги остаются без категории или переносятся в move_to,
+    подкатегории переходят к родителю удаляемой категории)
+    """
+    if move_to is not None:
+        if move_to == category_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Нельзя перенести книги в удаляемую категорию"
+            )
+        if get_category(db, move_to) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Категория с ID {move_to} не найдена"
+            )
+    
+    deleted = delete_category(db, category_id, move_to)
     if not deleted:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Категория с ID {category_id} не найдена"
         )
+    schedule_partition_sync(db)
     return None
\ No newline at end of file
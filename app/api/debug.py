@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, status
+from fastapi.responses import FileResponse, PlainTextResponse
+from typing import Any, Dict, List, Optional
+import json
+
+from app.profiling import PROFILE_TOKEN, check_profile_token, list_profiles, profile_path
+
+
+def require_profile_token(x_profile_token: Optional[str] = Header(None)):
+    """Зависимость: доступ только с токеном администратора"""
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not check_profile_token(x_profile_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Неверный токен профилирования"
+        )
+
+
+router = APIRouter(
+    prefix="/debug",
+    tags=["debug"],
+    dependencies=[Depends(require_profile_token)],
+    include_in_schema=False
+)
+
+@router.get("/profiles")
+async def read_profiles() -> List[Dict[str, Any]]:
+    """
+    Список сохраненных профилей запросов (без стеков), новые первыми
+    """
+    return list_profiles()
+
+@router.get("/profiles/{name}")
+async def download_profile(
+    name: str,
+    format: str = Query("json", pattern="^(json|folded)$", description="json или folded (для flamegraph)")
+):
+    """
+    Скачать профиль запроса.
+    Формат folded - свернутые стеки для flamegraph.pl или speedscope
+    """
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Профиль {name} не найден"
+        )
+    if format == "folded":
+        with open(path, encoding="utf-8") as file:
+            stacks = json.load(file).get("stacks", {})
+        return PlainTextResponse(
+            "".join(f"{stack} {count}\n" for stack, count in stacks.items()),
+            headers={"Content-Disposition": f'attachment; filename="{name}.folded"'}
+        )
+    return FileResponse(path, media_type="application/json", filename=f"{name}.json")
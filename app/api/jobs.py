@@ -0,0 +1,72 @@
+from fastapi import APIRouter, HTTPException, Depends, status
+from sqlalchemy.orm import Session
+
+from app.db.crud import create_job, get_job, cancel_job
+from app.db.db import get_db
+from app.jobs import JOB_HANDLERS, JobQueueFull, split_job_params, submit_job
+from app.schemas import JobCreate, JobResponse
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"],
+    responses={404: {"description": "Задача не найдена"}}
+)
+
+@router.post("/", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_new_job(job: JobCreate, db: Session = Depends(get_db)):
+    """
+    Запустить фоновую задачу
+    
+    Типы задач:
+    - **similarity_refresh**: пересчет похожих книг (params: full)
+    - **category_stats_refresh**: обновление статистики по категориям
+    - **partition_sync**: секции books для новых и удаленных категорий (BOOKS_PARTITIONING=list)
+    - **export_books**: выгрузка книг в CSV (params: category_id)
+    - **import_books**: загрузка книг (params: books)
+    """
+    if job.kind not in JOB_HANDLERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестный тип задачи: {job.kind}"
+        )
+    
+    params, payload = split_job_params(job.kind, job.params)
+    new_job = create_job(db, job.kind, params, payload)
+    if new_job is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка при создании задачи"
+        )
+    
+    try:
+        submit_job(new_job.id)
+    except JobQueueFull:
+        cancel_job(db, new_job.id)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Очередь задач заполнена, повторите запрос позже",
+            headers={"Retry-After": "10"}
+        )
+    return new_job
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def read_job(job_id: int, db: Session = Depends(get_db)):
+    """Получить статус и прогресс задачи"""
+    job = get_job(db, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Задача с ID {job_id} не найдена"
+        )
+    return job
+
+@router.post("/{job_id}/cancel", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def cancel_existing_job(job_id: int, db: Session = Depends(get_db)):
+    """Отменить задачу (выполняющаяся задача остановится при следующем обновлении прогресса)"""
+    job = cancel_job(db, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Задача с ID {job_id} не найдена"
+        )
+    return job
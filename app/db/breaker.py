@@ -0,0 +1,185 @@
+"""
+Автоматический выключатель (circuit breaker) для соединений с БД
+
+Во время переключения PostgreSQL на реплику каждый запрос ждал полный
+таймаут подключения и выдачи соединения из пула. Выключатель следит за
+выдачей соединений в get_db:
+    closed     - соединения выдаются как обычно, неудачи и медленные
+                 выдачи считаются в скользящем окне;
+    open       - доля неудач в окне превысила порог: запросы сразу получают
+                 DatabaseUnavailableError (503 или устаревший ответ из кэша);
+    half-open  - после паузы несколько пробных запросов идут в БД; если они
+                 успешны, выключатель замыкается, иначе снова размыкается.
+
+Неудачами считаются ошибки подключения, таймаут ожидания пула, разрывы
+соединения во время запроса и выдачи нового соединения дольше
+DB_BREAKER_SLOW_MS (см. MonitoredQueuePool в app.db.db). Повторные выдачи
+уже открытых соединений в окно не попадают - они не разбавляют долю неудач. Пробный запрос, так и не обратившийся к БД, через
+DB_BREAKER_OPEN_SECONDS уступает место следующему.
+
+Настройки через переменные окружения:
+    DB_BREAKER_FAILURE_RATE   - доля неудач для размыкания (по умолчанию 0.5)
+    DB_BREAKER_MIN_CALLS      - минимум выдач в окне для оценки (по умолчанию 10)
+    DB_BREAKER_WINDOW         - скользящее окно, секунды (по умолчанию 10)
+    DB_BREAKER_SLOW_MS        - медленная выдача соединения, мс (по умолчанию 2000)
+    DB_BREAKER_OPEN_SECONDS   - пауза до пробных запросов, секунды (по умолчанию 5)
+    DB_BREAKER_PROBES         - число пробных запросов (по умолчанию 2)
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+
+FAILURE_RATE = float(os.getenv("DB_BREAKER_FAILURE_RATE", "0.5"))
+MIN_CALLS = int(os.getenv("DB_BREAKER_MIN_CALLS", "10"))
+WINDOW = float(os.getenv("DB_BREAKER_WINDOW", "10"))
+SLOW_MS = float(os.getenv("DB_BREAKER_SLOW_MS", "2000"))
+OPEN_SECONDS = float(os.getenv("DB_BREAKER_OPEN_SECONDS", "5"))
+PROBES = int(os.getenv("DB_BREAKER_PROBES", "2"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class DatabaseUnavailableError(Exception):
+    """БД недоступна; запрос нужно завершить сразу"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(DatabaseUnavailableError):
+    """Выключатель разомкнут, запрос в БД не отправлялся"""
+
+
+# Ошибки, которые означают недоступность БД, а не ошибку запроса:
+# на них отвечают 503 (или устаревшим ответом), а не 500
+DATABASE_UNAVAILABLE_ERRORS = (DatabaseUnavailableError, OperationalError, PoolTimeoutError)
+
+
+class CircuitBreaker:
+    """Выключатель с состояниями closed, open и half-open"""
+
+    def __init__(
+        self,
+        failure_rate: float = FAILURE_RATE,
+        min_calls: int = MIN_CALLS,
+        window: float = WINDOW,
+        slow_ms: float = SLOW_MS,
+        open_seconds: float = OPEN_SECONDS,
+        probes: int = PROBES,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow = slow_ms / 1000
+        self.open_seconds = open_seconds
+        self.probes = max(1, probes)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        # (время, неудача) для выдач соединений за последние window секунд
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._half_open_at = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        """Через сколько секунд выключатель начнет пропускать пробные запросы"""
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def is_open(self) -> bool:
+        """Разомкнут ли выключатель (пауза до пробных запросов еще идет)"""
+        return self.state == OPEN and self.retry_after() > 0
+
+    def before_call(self):
+        """
+        Проверяет, можно ли обращаться к БД
+
+        Raises:
+            CircuitOpenError: Если выключатель разомкнут или пробные запросы уже идут
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if self.retry_after() > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError("База данных недоступна", self.retry_after() or 1)
+                self._half_open(time.monotonic())
+            if self.state == HALF_OPEN:
+                if self._probes_started >= self.probes and time.monotonic() - self._half_open_at > self.open_seconds:
+                    # Пробные запросы не дошли до БД (например, ответ из кэша)
+                    self._half_open(time.monotonic())
+                if self._probes_started >= self.probes:
+                    self.rejected += 1
+                    raise CircuitOpenError("База данных недоступна, идет проверка", 1)
+                self._probes_started += 1
+
+    def _half_open(self, now: float):
+        self.state = HALF_OPEN
+        self._half_open_at = now
+        self._probes_started = 0
+        self._probes_succeeded = 0
+
+    def record(self, duration: float):
+        """Учитывает выдачу соединения, на подключение которого ушло duration секунд"""
+        self._record(duration > self.slow)
+
+    def record_reuse(self, duration: float):
+        """Выдача уже открытого соединения: засчитывается только пробному запросу"""
+        if self.state == HALF_OPEN:
+            self.record(duration)
+
+    def record_failure(self):
+        """Учитывает ошибку соединения"""
+        self._record(True)
+
+    def _record(self, failed: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._probes_succeeded += 1
+                    if self._probes_succeeded >= self.probes:
+                        self.state = CLOSED
+                        self._calls.clear()
+                return
+            if self.state == OPEN:
+                return
+
+            self._calls.append((now, failed))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            failures = sum(1 for _, call_failed in self._calls if call_failed)
+            if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+        self._calls.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает состояние выключателя"""
+        with self._lock:
+            failures = sum(1 for _, failed in self._calls if failed)
+            return {
+                "state": OPEN if self.is_open() else (HALF_OPEN if self.state != CLOSED else CLOSED),
+                "calls_in_window": len(self._calls),
+                "failures_in_window": failures,
+                "retry_after": round(self.retry_after(), 2) if self.state == OPEN else 0,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+breaker = CircuitBreaker()
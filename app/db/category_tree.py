@@ -0,0 +1,80 @@
+"""
+Дерево категорий для существующих баз
+
+Таблица category_closure создается вместе с остальными (create_tables),
+но в базе, созданной до появления дерева, у categories нет колонки
+parent_id, а замыкание пустое. ensure_category_tree добавляет колонку
+и заполняет замыкание по parent_id; вызывается при запуске приложения.
+
+Если замыкание разошлось с parent_id (например, после ручных правок
+таблицы categories), его можно пересобрать целиком:
+
+Запуск: python -m app.db.category_tree
+"""
+from sqlalchemy import inspect, text
+
+from app.db.db import engine
+from app.db.models import CategoryClosure
+
+ADD_PARENT_COLUMN = [
+    "ALTER TABLE categories ADD COLUMN IF NOT EXISTS parent_id INTEGER "
+    "REFERENCES categories(id) ON DELETE SET NULL",
+    "CREATE INDEX IF NOT EXISTS ix_categories_parent_id ON categories (parent_id)",
+]
+
+# Рекурсивный запрос нужен только при пересборке; обычные запросы идут по замыканию
+REBUILD_CLOSURE = """
+INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+    SELECT id, id, 0 FROM categories
+    UNION ALL
+    SELECT tree.ancestor_id, categories.id, tree.depth + 1
+    FROM tree JOIN categories ON categories.parent_id = tree.descendant_id
+)
+SELECT ancestor_id, descendant_id, depth FROM tree
+"""
+
+
+def rebuild_category_closure(conn) -> int:
+    """
+    Пересобирает замыкание по parent_id (в транзакции conn)
+
+    Returns:
+        int: Число строк замыкания
+    """
+    conn.execute(CategoryClosure.__table__.delete())
+    conn.execute(text(REBUILD_CLOSURE))
+    return conn.execute(text("SELECT count(*) FROM category_closure")).scalar()
+
+
+def ensure_category_tree() -> bool:
+    """
+    Добавляет parent_id в categories и заполняет пустое замыкание
+
+    Returns:
+        bool: True если дерево готово, False в случае ошибки
+    """
+    try:
+        with engine.begin() as conn:
+            columns = {column["name"] for column in inspect(conn).get_columns("categories")}
+            if "parent_id" not in columns:
+                for statement in ADD_PARENT_COLUMN:
+                    conn.execute(text(statement))
+                print("В таблицу categories добавлена колонка parent_id")
+            CategoryClosure.__table__.create(conn, checkfirst=True)
+
+            has_closure = conn.execute(text("SELECT 1 FROM category_closure LIMIT 1")).first()
+            has_categories = conn.execute(text("SELECT 1 FROM categories LIMIT 1")).first()
+            if has_categories and not has_closure:
+                count = rebuild_category_closure(conn)
+                print(f"Замыкание дерева категорий заполнено, строк: {count}")
+        return True
+    except Exception as e:
+        print(f"Ошибка при подготовке дерева категорий: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    with engine.begin() as connection:
+        rows = rebuild_category_closure(connection)
+    print(f"Замыкание дерева категорий пересобрано, строк: {rows}")
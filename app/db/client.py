@@ -0,0 +1,175 @@
+"""
+Клиент каталога для скриптов и ETL
+
+В отличие от оберток *_simple из app.db.crud, которые на каждый вызов
+открывают сессию, делают commit и возвращают отсоединенные объекты,
+клиент держит одну сессию на весь сценарий:
+
+    with CatalogClient(batch_size=5000) as client:
+        category = client.add_category("Программирование")
+        for row in rows:
+            client.add_book(row.title, row.price, category_id=category.id)
+        for book in client.iter_books(category_id=category.id):
+            ...
+
+Записи копятся в буфере и отправляются в БД пачками по batch_size
+(многострочные INSERT/UPDATE/DELETE), commit выполняется при выходе из
+блока with или вызовом commit(). При исключении внутри with изменения
+откатываются. Чтение идет потоково, пачками по chunk_size строк.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from app.db.crud import get_book, get_category
+from app.db.db import SessionLocal
+from app.db.models import Book, Category
+from app.db.stats import note_writes
+
+
+class CatalogClient:
+    """Единица работы над каталогом: одна сессия, пакетная запись, потоковое чтение"""
+
+    def __init__(self, batch_size: int = 1000, session: Optional[Session] = None):
+        """
+        Args:
+            batch_size: Сколько изменений копится перед отправкой в БД
+            session: Готовая сессия (по умолчанию создается новая)
+        """
+        self.batch_size = batch_size
+        self.db = session if session is not None else SessionLocal()
+        self._owns_session = session is None
+        self._new_books = 0
+        self._book_updates: List[Dict[str, Any]] = []
+        self._book_deletes: List[int] = []
+
+    def __enter__(self) -> "CatalogClient":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.close()
+
+    def add_category(self, title: str, parent_id: Optional[int] = None) -> Category:
+        """Добавляет категорию; она сразу отправляется в БД, чтобы был известен id"""
+        category = Category(title=title, parent_id=parent_id)
+        self.db.add(category)
+        self.db.flush()
+        return category
+
+    def add_book(
+        self,
+        title: str,
+        price: float,
+        description: Optional[str] = None,
+        category_id: Optional[int] = None,
+        url: str = ''
+    ) -> Book:
+        """
+        Добавляет книгу в буфер
+
+        Returns:
+            Book: Книга, привязанная к сессии клиента (id появится после flush)
+        """
+        book = Book(title=title, price=price, description=description, category_id=category_id, url=url)
+        self.db.add(book)
+        self._new_books += 1
+        self._maybe_flush()
+        return book
+
+    def update_book(self, book_id: int, **kwargs):
+        """Добавляет в буфер изменение книги (поля со значением None пропускаются)"""
+        values = {key: value for key, value in kwargs.items() if value is not None}
+        if values:
+            self._book_updates.append({"id": book_id, **values})
+            self._maybe_flush()
+
+    def delete_book(self, book_id: int):
+        """Добавляет в буфер удаление книги"""
+        self._book_deletes.append(book_id)
+        self._maybe_flush()
+
+    def _pending(self) -> int:
+        return self._new_books + len(self._book_updates) + len(self._book_deletes)
+
+    def _maybe_flush(self):
+        if self._pending() >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Отправляет накопленные изменения в БД (без commit)"""
+        # Новые книги уходят многострочными INSERT ... RETURNING
+        self.db.flush()
+        self._new_books = 0
+
+        if self._book_updates:
+            # ORM bulk UPDATE по первичному ключу: один executemany на пачку
+            # (у строк с разным набором полей - по executemany на набор)
+            self.db.execute(update(Book), self._book_updates)
+            # Массовые UPDATE и DELETE обходят события ORM, которыми
+            # статистика категорий считает изменения - учитываем их сами
+            note_writes(len(self._book_updates))
+            self._book_updates = []
+
+        if self._book_deletes:
+            result = self.db.execute(
+                delete(Book)
+                .where(Book.id.in_(self._book_deletes))
+                .execution_options(synchronize_session=False)
+            )
+            note_writes(max(result.rowcount, 0))
+            self._book_deletes = []
+
+    def commit(self):
+        """Отправляет накопленные изменения и фиксирует транзакцию"""
+        self.flush()
+        self.db.commit()
+
+    def rollback(self):
+        """Отбрасывает буфер и откатывает транзакцию"""
+        self._new_books = 0
+        self._book_updates = []
+        self._book_deletes = []
+        self.db.rollback()
+
+    def close(self):
+        """Закрывает сессию, если клиент создавал ее сам"""
+        if self._owns_session:
+            self.db.close()
+
+    def get_book(self, book_id: int) -> Optional[Book]:
+        """Получает книгу по ID (объект привязан к сессии клиента)"""
+        return get_book(self.db, book_id)
+
+    def get_category(self, category_id: int) -> Optional[Category]:
+        """Получает категорию по ID (объект привязан к сессии клиента)"""
+        return get_category(self.db, category_id)
+
+    def iter_books(self, category_id: Optional[int] = None, chunk_size: int = 1000) -> Iterator[Book]:
+        """
+        Потоково перебирает книги по возрастанию id
+
+        Args:
+            category_id: ID категории для фильтрации (опционально)
+            chunk_size: Сколько строк читается из БД за раз
+
+        Returns:
+            Iterator[Book]: Книги
+        """
+        self.flush()
+        statement = select(Book).order_by(Book.id)
+        if category_id is not None:
+            statement = statement.where(Book.category_id == category_id)
+        yield from self.db.execute(statement.execution_options(yield_per=chunk_size)).scalars()
+
+    def iter_categories(self, chunk_size: int = 1000) -> Iterator[Category]:
+        """Потоково перебирает категории по названию"""
+        self.flush()
+        statement = select(Category).order_by(Category.title)
+        yield from self.db.execute(statement.execution_options(yield_per=chunk_size)).scalars()
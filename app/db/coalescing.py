@@ -0,0 +1,123 @@
+"""
+Объединение одинаковых одновременных запросов на чтение (single-flight)
+
+Если несколько обработчиков одновременно запрашивают одно и то же
+(например, GET /books/42 для книги с главной страницы), запрос к БД
+выполняет только первый из них, а остальные ждут и получают тот же
+результат. Так на всплеск одинаковых запросов тратится одно соединение
+из пула, а не по одному на каждый HTTP-запрос.
+
+Общий запрос выполняется отдельной задачей в своей сессии и не зависит
+от того, кто его начал: отмена (например, разрыв соединения клиентом)
+достается только отмененному вызывающему. Результат - схемы ответа
+(BookResponse), не привязанные к сессии, а списки отдаются кортежами;
+общий результат никто не изменяет.
+
+Объединяются только запросы, выполняющиеся в одно и то же время внутри
+одного процесса; готовые результаты не кэшируются.
+"""
+import asyncio
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.db.crud import get_book, get_books_by_category, search_books
+from app.db.db import SessionLocal
+from app.schemas import BookResponse, book_fields_schema
+
+
+class SingleFlight:
+    """Выполняет не более одного вызова на ключ одновременно"""
+
+    def __init__(self, session_factory: Callable = SessionLocal):
+        """
+        Args:
+            session_factory: Фабрика сессий для общих запросов
+        """
+        self.session_factory = session_factory
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable, *args, fields: Optional[Tuple[str, ...]] = None) -> Any:
+        """
+        Выполняет func(db, *args) в пуле потоков или присоединяется к уже идущему вызову
+
+        Args:
+            key: Ключ, по которому совпадают одинаковые вызовы
+            func: Синхронная функция чтения crud, возвращающая книгу или список книг
+            *args: Аргументы функции после сессии
+            fields: Набор полей ответа (None - все поля BookResponse)
+
+        Returns:
+            Any: Книга (схема ответа), кортеж книг или None - общий для всех объединенных вызовов
+        """
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(run_in_threadpool(self._read, func, args, fields))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _read(self, func: Callable, args: tuple, fields: Optional[Tuple[str, ...]]) -> Any:
+        schema = book_fields_schema(fields) if fields else BookResponse
+        with self.session_factory() as db:
+            result = func(db, *args)
+            if result is None:
+                return None
+            if isinstance(result, list):
+                return tuple(schema.model_validate(book) for book in result)
+            return schema.model_validate(result)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Исключение получат ожидающие; если все они отменены, оно не должно попасть в лог как необработанное
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает счетчики вызовов"""
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
+
+
+_flight = SingleFlight()
+
+
+async def get_book_coalesced(
+    book_id: int, fields: Optional[Tuple[str, ...]] = None
+) -> Optional[BookResponse]:
+    """Получает книгу по ID, объединяя одинаковые одновременные запросы"""
+    return await _flight.do(("get_book", book_id, fields), get_book, book_id, fields, fields=fields)
+
+
+async def get_books_by_category_coalesced(
+    category_id: int, fields: Optional[Tuple[str, ...]] = None, subtree: bool = False
+) -> Optional[Tuple[BookResponse, ...]]:
+    """Получает книги категории (или ее поддерева), объединяя одинаковые одновременные запросы"""
+    return await _flight.do(
+        ("get_books_by_category", category_id, fields, subtree),
+        get_books_by_category, category_id, fields, subtree, fields=fields
+    )
+
+
+async def search_books_coalesced(
+    query: str, fields: Optional[Tuple[str, ...]] = None
+) -> Optional[Tuple[BookResponse, ...]]:
+    """Поиск книг, объединяющий одинаковые одновременные запросы"""
+    return await _flight.do(("search_books", query, fields), search_books, query, fields, fields=fields)
+
+
+def get_coalescing_stats() -> Dict[str, int]:
+    """Возвращает статистику объединения запросов в текущем процессе"""
+    return _flight.stats()
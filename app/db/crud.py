@@ -1,24 +1,78 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from app.db.models import Category, Book
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import or_, select, bindparam, text, func, update, delete, insert, true, Integer
+from sqlalchemy.sql import Select
+from app.db.models import Category, CategoryClosure, Book, BookSimilarity, Job, CATEGORY_STATS_VIEW
 from app.db.db import SessionLocal
-from typing import Optional, List, Dict, Any
-
-
-
-def create_category(db: Session, title: str) -> Optional[Category]:
+from app.db.stats import note_writes
+from typing import Optional, List, Dict, Any, Sequence, Tuple
+from functools import lru_cache
+from array import array
+
+
+# Частые запросы собираются один раз при импорте: на каждый вызов остается
+# только подстановка параметров, а скомпилированный SQL берется из кэша движка
+_GET_CATEGORY = select(Category).where(Category.id == bindparam("category_id"))
+_GET_BOOK = select(Book).where(Book.id == bindparam("book_id"))
+_ALL_BOOKS = select(Book).order_by(Book.title)
+_BOOKS_BY_CATEGORY = (
+    select(Book)
+    .where(Book.category_id == bindparam("category_id"))
+    .order_by(Book.title)
+)
+# Книги категории и всех ее подкатегорий: одно соединение с таблицей замыкания
+_BOOKS_IN_SUBTREE = (
+    select(Book)
+    .join(CategoryClosure, CategoryClosure.descendant_id == Book.category_id)
+    .where(CategoryClosure.ancestor_id == bindparam("category_id"))
+    .order_by(Book.title)
+)
+# Перенос, удаление и создание категорий с родителем меняют замыкание для
+# целых поддеревьев; на PostgreSQL они выполняются по очереди (блокировка до
+# конца транзакции), иначе два встречных переноса могут создать цикл
+_CATEGORY_TREE_LOCK_KEY = 735002
+_SEARCH_BOOKS = (
+    select(Book)
+    .where(or_(Book.title.ilike(bindparam("search")), Book.description.ilike(bindparam("search"))))
+    .order_by(Book.title)
+)
+
+
+@lru_cache(maxsize=256)
+def _only_book_fields(statement: Select, fields: Tuple[str, ...]) -> Select:
+    """Ограничивает SELECT книг указанными полями (остальные колонки не загружаются)"""
+    columns = [getattr(Book, name) for name in fields if name in Book.__table__.columns]
+    return statement.options(load_only(*columns))
+
+
+def _book_statement(statement: Select, fields: Optional[Sequence[str]]) -> Select:
+    """Возвращает готовый запрос книг с учетом набора полей"""
+    if not fields:
+        return statement
+    return _only_book_fields(statement, tuple(fields))
+
+
+def _lock_category_tree(db: Session):
+    """Блокирует изменения дерева категорий до конца транзакции (только PostgreSQL)"""
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _CATEGORY_TREE_LOCK_KEY})
+
+def create_category(db: Session, title: str, parent_id: Optional[int] = None) -> Optional[Category]:
     """
     Создает новую категорию
     
     Args:
         db: Сессия базы данных
         title: Название категории
+        parent_id: ID родительской категории (опционально)
     
     Returns:
         Category: Созданная категория или None в случае ошибки
     """
     try:
-        category = Category(title=title)
+        # Строки замыкания добавляет обработчик after_insert в app.db.models
+        if parent_id is not None:
+            _lock_category_tree(db)
+        category = Category(title=title, parent_id=parent_id)
         db.add(category)
         db.commit()
         db.refresh(category)
@@ -39,7 +93,7 @@ def get_category(db: Session, category_id: int) -> Optional[Category]:
     Returns:
         Category: Категория или None если не найдена
     """
-    return db.query(Category).filter(Category.id == category_id).first()
+    return db.execute(_GET_CATEGORY, {"category_id": category_id}).scalars().first()
 
 def get_all_categories(db: Session) -> List[Category]:
     """
@@ -77,30 +131,222 @@ def update_category(db: Session, category_id: int, title: str) -> Optional[Categ
         print(f"Ошибка при обновлении категории: {e}")
         return None
 
-def delete_category(db: Session, category_id: int) -> bool:
+def _move_books(db: Session, category_id: int, target_category_id: Optional[int]) -> int:
+    """Переносит книги категории одним UPDATE, без загрузки книг в сессию (без commit)"""
+    result = db.execute(
+        update(Book)
+        .where(Book.category_id == category_id)
+        .values(category_id=target_category_id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+def move_category_books(db: Session, category_id: int, target_category_id: Optional[int]) -> Optional[int]:
+    """
+    Переносит все книги категории в другую категорию
+    
+    Args:
+        db: Сессия базы данных
+        category_id: ID исходной категории
+        target_category_id: ID целевой категории (None - оставить книги без категории)
+    
+    Returns:
+        int: Число перенесенных книг или None в случае ошибки
+    """
+    try:
+        moved = _move_books(db, category_id, target_category_id)
+        db.commit()
+        note_writes(moved)
+        return moved
+    except Exception as e:
+        db.rollback()
+        print(f"Ошибка при переносе книг категории: {e}")
+        return None
+
+def _lift_children(db: Session, category_id: int):
+    """Поднимает подкатегории удаляемой категории на уровень выше (без commit)"""
+    closure = CategoryClosure.__table__
+    subtree = select(closure.c.descendant_id).where(
+        closure.c.ancestor_id == category_id, closure.c.descendant_id != category_id
+    )
+    ancestors = select(closure.c.ancestor_id).where(
+        closure.c.descendant_id == category_id, closure.c.ancestor_id != category_id
+    )
+    db.execute(
+        closure.update()
+        .where(closure.c.descendant_id.in_(subtree), closure.c.ancestor_id.in_(ancestors))
+        .values(depth=closure.c.depth - 1)
+    )
+    db.execute(closure.delete().where(
+        or_(closure.c.ancestor_id == category_id, closure.c.descendant_id == category_id)
+    ))
+    parent_id = select(Category.parent_id).where(Category.id == category_id).scalar_subquery()
+    db.execute(
+        update(Category)
+        .where(Category.parent_id == category_id)
+        .values(parent_id=parent_id)
+        .execution_options(synchronize_session=False)
+    )
+
+def delete_category(db: Session, category_id: int, move_to: Optional[int] = None) -> bool:
     """
     Удаляет категорию
     
+    Удаление выполняется одним DELETE: книги не загружаются в сессию,
+    их category_id обнуляет ограничение ondelete="SET NULL".
+    Подкатегории переходят к родителю удаляемой категории.
+    
     Args:
         db: Сессия базы данных
         category_id: ID категории
+        move_to: ID категории, в которую перед удалением переносятся книги (опционально)
     
     Returns:
         bool: True если удаление успешно, False если категория не найдена или ошибка
     """
     try:
-        category = db.query(Category).filter(Category.id == category_id).first()
-        if category:
-            db.delete(category)
-            db.commit()
-            return True
-        return False
+        moved = 0
+        _lock_category_tree(db)
+        if move_to is not None:
+            moved = _move_books(db, category_id, move_to)
+        _lift_children(db, category_id)
+        result = db.execute(
+            delete(Category)
+            .where(Category.id == category_id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            db.rollback()
+            return False
+        db.commit()
+        note_writes(moved + 1)
+        return True
     except Exception as e:
         db.rollback()
         print(f"Ошибка при удалении категории: {e}")
         return False
 
 
+def is_in_subtree(db: Session, category_id: int, root_id: int) -> bool:
+    """
+    Проверяет, входит ли категория в поддерево root_id (включая саму root_id)
+    
+    Args:
+        db: Сессия базы данных
+        category_id: ID проверяемой категории
+        root_id: ID корня поддерева
+    
+    Returns:
+        bool: True если category_id - это root_id или ее потомок
+    """
+    return db.execute(
+        select(CategoryClosure.depth)
+        .where(CategoryClosure.ancestor_id == root_id, CategoryClosure.descendant_id == category_id)
+    ).first() is not None
+
+def move_category_subtree(db: Session, category_id: int, parent_id: Optional[int]) -> Optional[Category]:
+    """
+    Переносит категорию вместе с поддеревом под другого родителя
+    
+    Замыкание обновляется двумя запросами на все поддерево: удаляются связи
+    поддерева со старыми предками и добавляются связи с новыми. Проверка на
+    цикл (перенос в собственное поддерево) выполняется под блокировкой
+    дерева, поэтому одновременные встречные переносы цикл не создадут.
+    
+    Args:
+        db: Сессия базы данных
+        category_id: ID переносимой категории
+        parent_id: ID нового родителя (None - сделать категорию корневой)
+    
+    Returns:
+        Category: Перенесенная категория или None если не найдена или ошибка
+    
+    Raises:
+        ValueError: Если parent_id - сама категория или ее потомок
+    """
+    closure = CategoryClosure.__table__
+    try:
+        _lock_category_tree(db)
+        category = get_category(db, category_id)
+        if category is None:
+            db.rollback()
+            return None
+        if parent_id is not None and is_in_subtree(db, parent_id, category_id):
+            db.rollback()
+            raise ValueError("Нельзя перенести категорию в ее собственное поддерево")
+        subtree = select(closure.c.descendant_id).where(closure.c.ancestor_id == category_id)
+        old_ancestors = select(closure.c.ancestor_id).where(
+            closure.c.descendant_id == category_id, closure.c.ancestor_id != category_id
+        )
+        db.execute(closure.delete().where(
+            closure.c.descendant_id.in_(subtree), closure.c.ancestor_id.in_(old_ancestors)
+        ))
+        if parent_id is not None:
+            above = closure.alias("above")
+            below = closure.alias("below")
+            db.execute(closure.insert().from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1)
+                .select_from(above.join(below, true()))
+                .where(above.c.descendant_id == parent_id, below.c.ancestor_id == category_id)
+            ))
+        category.parent_id = parent_id
+        db.commit()
+        db.refresh(category)
+        return category
+    except ValueError:
+        raise
+    except Exception as e:
+        db.rollback()
+        print(f"Ошибка при переносе категории: {e}")
+        return None
+
+def get_subtree_book_counts(db: Session, category_id: int) -> List[Dict[str, Any]]:
+    """
+    Получает категории поддерева с числом книг в каждой и во всем ее поддереве
+    
+    Книги поддерева считаются одним проходом по категориям, а суммы по
+    поддеревьям складываются из этих счетчиков по замыканию: объем работы
+    растет как книги + категории x глубина, а не книги x глубина.
+    
+    Args:
+        db: Сессия базы данных
+        category_id: ID корня поддерева
+    
+    Returns:
+        List[Dict[str, Any]]: category_id, title, parent_id, depth (от корня),
+        books_count, subtree_books_count; по глубине и названию
+    """
+    root = CategoryClosure.__table__.alias("root")
+    scope = CategoryClosure.__table__.alias("scope")
+    node = CategoryClosure.__table__.alias("node")
+    direct_books = (
+        select(Book.category_id, func.count().label("books_count"))
+        .join(scope, scope.c.descendant_id == Book.category_id)
+        .where(scope.c.ancestor_id == category_id)
+        .group_by(Book.category_id)
+        .subquery("direct_books")
+    )
+    result = db.execute(
+        select(
+            Category.id.label("category_id"),
+            Category.title,
+            Category.parent_id,
+            root.c.depth,
+            func.coalesce(
+                func.sum(direct_books.c.books_count).filter(node.c.depth == 0), 0
+            ).cast(Integer).label("books_count"),
+            func.coalesce(func.sum(direct_books.c.books_count), 0).cast(Integer).label("subtree_books_count"),
+        )
+        .select_from(root)
+        .join(Category, Category.id == root.c.descendant_id)
+        .join(node, node.c.ancestor_id == root.c.descendant_id)
+        .outerjoin(direct_books, direct_books.c.category_id == node.c.descendant_id)
+        .where(root.c.ancestor_id == category_id)
+        .group_by(Category.id, Category.title, Category.parent_id, root.c.depth)
+        .order_by(root.c.depth, Category.title)
+    )
+    return [dict(row) for row in result.mappings()]
 
 def create_book(
     db: Session, 
@@ -141,34 +387,91 @@ def create_book(
         print(f"Ошибка при создании книги: {e}")
         return None
 
-def get_book(db: Session, book_id: int) -> Optional[Book]:
+def _insert_books(db: Session, rows: List[Dict[str, Any]]) -> List[Book]:
+    books = db.execute(
+        insert(Book).returning(Book, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    # Отсоединяем до commit, чтобы загруженные поля не были сброшены
+    for book in books:
+        db.expunge(book)
+    return books
+
+def create_books_batch(db: Session, rows: List[Dict[str, Any]]) -> List[Optional[Book]]:
+    """
+    Создает несколько книг одной транзакцией (многострочный INSERT ... RETURNING)
+
+    Если общая вставка не удалась, строки вставляются по одной в точках
+    сохранения, так что ошибка одной строки не мешает остальным.
+
+    Args:
+        db: Сессия базы данных
+        rows: Поля книг (title, price, description, category_id, url)
+
+    Returns:
+        List[Optional[Book]]: Книги в порядке rows; None для строк с ошибкой
+    """
+    try:
+        books = _insert_books(db, rows)
+        db.commit()
+        note_writes(len(books))
+        return books
+    except Exception as e:
+        db.rollback()
+        if len(rows) == 1:
+            print(f"Ошибка при создании книги: {e}")
+            return [None]
+
+    results: List[Optional[Book]] = []
+    try:
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    results.append(_insert_books(db, [row])[0])
+            except Exception as e:
+                print(f"Ошибка при создании книги: {e}")
+                results.append(None)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Ошибка при создании книг: {e}")
+        return [None] * len(rows)
+    note_writes(sum(book is not None for book in results))
+    return results
+
+def get_book(db: Session, book_id: int, fields: Optional[Sequence[str]] = None) -> Optional[Book]:
     """
     Получает книгу по ID
     
     Args:
         db: Сессия базы данных
         book_id: ID книги
+        fields: Загружаемые поля (опционально, по умолчанию все)
     
     Returns:
         Book: Книга или None если не найдена
     """
-    return db.query(Book).filter(Book.id == book_id).first()
+    statement = _book_statement(_GET_BOOK, fields)
+    return db.execute(statement, {"book_id": book_id}).scalars().first()
 
-def get_all_books(db: Session, category_id: Optional[int] = None) -> List[Book]:
+def get_all_books(
+    db: Session, 
+    category_id: Optional[int] = None, 
+    fields: Optional[Sequence[str]] = None
+) -> List[Book]:
     """
     Получает все книги, опционально фильтрует по категории
     
     Args:
         db: Сессия базы данных
         category_id: ID категории для фильтрации (опционально)
+        fields: Загружаемые поля (опционально, по умолчанию все)
     
     Returns:
         List[Book]: Список книг
     """
-    query = db.query(Book)
     if category_id is not None:
-        query = query.filter(Book.category_id == category_id)
-    return query.order_by(Book.title).all()
+        return get_books_by_category(db, category_id, fields)
+    return list(db.execute(_book_statement(_ALL_BOOKS, fields)).scalars())
 
 def update_book(db: Session, book_id: int, **kwargs) -> Optional[Book]:
     """
@@ -223,37 +526,66 @@ def delete_book(db: Session, book_id: int) -> bool:
         print(f"Ошибка при удалении книги: {e}")
         return False
 
-def get_books_by_category(db: Session, category_id: int) -> List[Book]:
+def get_books_by_category(
+    db: Session, 
+    category_id: int, 
+    fields: Optional[Sequence[str]] = None,
+    subtree: bool = False
+) -> List[Book]:
     """
     Получает все книги в определенной категории
     
     Args:
         db: Сессия базы данных
         category_id: ID категории
+        fields: Загружаемые поля (опционально, по умолчанию все)
+        subtree: Включать книги всех подкатегорий
     
     Returns:
         List[Book]: Список книг в категории
     """
-    return db.query(Book).filter(Book.category_id == category_id).order_by(Book.title).all()
+    statement = _book_statement(_BOOKS_IN_SUBTREE if subtree else _BOOKS_BY_CATEGORY, fields)
+    return list(db.execute(statement, {"category_id": category_id}).scalars())
 
-def search_books(db: Session, query: str) -> List[Book]:
+def search_books(db: Session, query: str, fields: Optional[Sequence[str]] = None) -> List[Book]:
     """
     Поиск книг по названию или описанию
     
     Args:
         db: Сессия базы данных
         query: Поисковый запрос
+        fields: Загружаемые поля (опционально, по умолчанию все)
     
     Returns:
         List[Book]: Список найденных книг
     """
     search = f"%{query}%"
-    return db.query(Book).filter(
-        or_(
-            Book.title.ilike(search),
-            Book.description.ilike(search)
-        )
-    ).order_by(Book.title).all()
+    statement = _book_statement(_SEARCH_BOOKS, fields)
+    return list(db.execute(statement, {"search": search}).scalars())
+
+def get_similar_books(db: Session, book_id: int, limit: int = 10) -> Optional[List[Book]]:
+    """
+    Получает похожие книги из предрассчитанной таблицы book_similarities
+    
+    Args:
+        db: Сессия базы данных
+        book_id: ID книги
+        limit: Максимальное число похожих книг
+    
+    Returns:
+        List[Book]: Похожие книги по убыванию сходства или None если книга не найдена
+    """
+    similarity = db.get(BookSimilarity, book_id)
+    if similarity is None:
+        return None if get_book(db, book_id) is None else []
+    
+    similar_ids = array("i", similarity.similar_ids)[:limit]
+    books = {
+        book.id: book
+        for book in db.execute(select(Book).where(Book.id.in_(similar_ids))).scalars()
+    }
+    # Книги, удаленные после расчета, пропускаются
+    return [books[similar_id] for similar_id in similar_ids if similar_id in books]
 
 def count_books(db: Session, category_id: Optional[int] = None) -> int:
     """
@@ -271,6 +603,19 @@ def count_books(db: Session, category_id: Optional[int] = None) -> int:
         query = query.filter(Book.category_id == category_id)
     return query.count()
 
+def get_category_stats(db: Session) -> List[Dict[str, Any]]:
+    """
+    Получает статистику цен по категориям из материализованного представления
+    
+    Args:
+        db: Сессия базы данных
+    
+    Returns:
+        List[Dict[str, Any]]: Строки представления category_price_stats
+    """
+    result = db.execute(text(f"SELECT * FROM {CATEGORY_STATS_VIEW} ORDER BY title"))
+    return [dict(row) for row in result.mappings()]
+
 def count_categories(db: Session) -> int:
     """
     Подсчитывает количество категорий
@@ -285,6 +630,83 @@ def count_categories(db: Session) -> int:
 
 
 
+def create_job(
+    db: Session,
+    kind: str,
+    params: Optional[Dict[str, Any]] = None,
+    payload: Optional[Dict[str, Any]] = None
+) -> Optional[Job]:
+    """
+    Создает фоновую задачу в статусе pending
+    
+    Args:
+        db: Сессия базы данных
+        kind: Тип задачи
+        params: Параметры задачи (опционально)
+        payload: Объемные входные данные задачи (опционально, в ответах API не видны)
+    
+    Returns:
+        Job: Созданная задача или None в случае ошибки
+    """
+    try:
+        job = Job(
+            kind=kind, params=params or {}, payload=payload, status="pending", progress=0, cancel_requested=False
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+    except Exception as e:
+        db.rollback()
+        print(f"Ошибка при создании задачи: {e}")
+        return None
+
+def get_job(db: Session, job_id: int) -> Optional[Job]:
+    """
+    Получает задачу по ID
+    
+    Args:
+        db: Сессия базы данных
+        job_id: ID задачи
+    
+    Returns:
+        Job: Задача или None если не найдена
+    """
+    return db.get(Job, job_id)
+
+def cancel_job(db: Session, job_id: int) -> Optional[Job]:
+    """
+    Отменяет задачу: ожидающая отменяется сразу, выполняющейся выставляется флаг отмены
+    
+    Args:
+        db: Сессия базы данных
+        job_id: ID задачи
+    
+    Returns:
+        Job: Задача или None если не найдена
+    """
+    try:
+        job = db.get(Job, job_id)
+        if job is None:
+            return None
+        if job.status in ("pending", "running"):
+            job.cancel_requested = True
+            if job.status == "pending":
+                job.status = "cancelled"
+                job.finished_at = func.now()
+            db.commit()
+        db.refresh(job)
+        return job
+    except Exception as e:
+        db.rollback()
+        print(f"Ошибка при отмене задачи: {e}")
+        return None
+
+
+# Обертки ниже открывают отдельную сессию и делают commit на каждый вызов.
+# Для скриптов, работающих с большим числом записей, используйте
+# app.db.client.CatalogClient: одна сессия, пакетная запись и потоковое чтение
+
 def create_category_simple(title: str) -> Optional[Category]:
     """Обертка для create_category без передачи сессии"""
     db = SessionLocal()
@@ -1,11 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.exc import SQLAlchemyError
 from contextlib import contextmanager
 from sqlalchemy import text
 from dotenv import load_dotenv
 import os
+import threading
+import time
+
+from app.db.breaker import breaker
 
 load_dotenv()
 
@@ -15,25 +20,111 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+# Размер пула на процесс; при запуске через app.server задается из общего бюджета соединений
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Таймауты подключения и ожидания соединения из пула, секунды: при
+# недоступной БД запрос завершается быстро, а выключатель узнает об этом сразу
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "3"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+
+
+# Драйвер: psycopg2 (по умолчанию) или psycopg (psycopg 3), который
+# после DB_PREPARE_THRESHOLD выполнений запроса готовит его на сервере
+DB_DRIVER = os.getenv("DB_DRIVER", "psycopg2")
+DB_PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "5"))
+
+DATABASE_URL = f"postgresql+{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT}
+if DB_DRIVER == "psycopg":
+    connect_args["prepare_threshold"] = DB_PREPARE_THRESHOLD
+
+
+# Выключатель (app.db.breaker) узнает о состоянии БД при выдаче соединений
+# из пула. Сами запросы соединение заранее не берут, поэтому выдача
+# учитывается здесь, а не в get_db
+_checkout = threading.local()
+
+
+class MonitoredQueuePool(QueuePool):
+    """
+    QueuePool, сообщающий выключателю о каждой выдаче соединения
+
+    Время считается от начала выдачи: ожидание свободного места в пуле
+    плюс подключение. Таймаут ожидания пула (не ошибка DBAPI, событие
+    handle_error на него не срабатывает) считается неудачей
+    """
 
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    def connect(self):
+        started = time.monotonic()
+        _checkout.created = False
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            breaker.record_failure()
+            raise
+        duration = time.monotonic() - started
+        if _checkout.created:
+            breaker.record(duration)
+        else:
+            breaker.record_reuse(duration)
+        return connection
 
 
 engine = create_engine(
     DATABASE_URL,
-    pool_size=5,
-    max_overflow=10,
+    poolclass=MonitoredQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    connect_args=connect_args,
     echo=False  
 )
 
 
+def reset_engine_after_fork():
+    """
+    Сбрасывает пул соединений в дочернем процессе после fork.
+    
+    Соединения, открытые родителем (например, при preload приложения),
+    не закрываются, а просто забываются: закрывать их должен только родитель.
+    Новые соединения пул создаст уже в самом воркере.
+    """
+    engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_engine_after_fork)
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
 Base = declarative_base()
 
+@event.listens_for(engine, "connect")
+def mark_new_connection(dbapi_connection, connection_record):
+    """Выдача создала новое соединение (а не взяла открытое из пула)"""
+    _checkout.created = True
+
+
+@event.listens_for(engine, "handle_error")
+def record_connection_error(context):
+    """Ошибка подключения (connection is None) или разрыв соединения"""
+    if context.connection is None or context.is_disconnect:
+        breaker.record_failure()
+
+
 def get_db():
-    """Функция для получения сессии БД (для зависимостей FastAPI)"""
+    """
+    Функция для получения сессии БД (для зависимостей FastAPI)
+    
+    Пока выключатель разомкнут, запрос сразу завершается CircuitOpenError.
+    Соединение берется из пула только при первом запросе к БД
+    """
+    breaker.before_call()
     db = SessionLocal()
     try:
         yield db
@@ -70,7 +161,7 @@ def test_connection():
 def create_database():
     """Создает базу данных, если она не существует"""
     
-    temp_url = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/postgres"
+    temp_url = f"postgresql+{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/postgres"
     temp_engine = create_engine(temp_url)
     
     try:
@@ -0,0 +1,154 @@
+"""
+Групповая фиксация для одновременных POST /books/
+
+При массовой загрузке каталога партнерами каждая вставка книги - это
+отдельная транзакция, и большую часть времени PostgreSQL тратит на
+сброс WAL на диск при commit. В режиме групповой фиксации вставки,
+пришедшие в течение окна BOOKS_GROUP_COMMIT_MS миллисекунд, отправляются
+одним многострочным INSERT ... RETURNING в одной транзакции. Каждый
+вызывающий получает свою строку; если общая вставка не удалась, строки
+вставляются по одной (см. crud.create_books_batch), и ошибка достается
+только тому, чья строка ее вызвала.
+
+Пачки собираются внутри одного процесса. Соединение для пачки берется
+из пула только на время ее транзакции; при остановке приложения
+(stop_group_commit) накопленная пачка отправляется и дожидается фиксации.
+
+Настройки через переменные окружения:
+    BOOKS_GROUP_COMMIT_MS   - окно сбора пачки в мс (по умолчанию 0 - режим выключен)
+    BOOKS_GROUP_COMMIT_MAX  - максимальный размер пачки (по умолчанию 500)
+"""
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.db.crud import create_books_batch
+from app.db.db import SessionLocal
+from app.db.models import Book
+
+GROUP_COMMIT_MS = float(os.getenv("BOOKS_GROUP_COMMIT_MS", "0"))
+GROUP_COMMIT_MAX = int(os.getenv("BOOKS_GROUP_COMMIT_MAX", "500"))
+
+
+class GroupCommitter:
+    """Собирает одновременные вставки в пачки и фиксирует их одной транзакцией"""
+
+    def __init__(self, window_ms: float, max_batch: int, session_factory: Callable = SessionLocal):
+        """
+        Args:
+            window_ms: Сколько ждать попутчиков после первой вставки в пачке
+            max_batch: Размер пачки, при котором она отправляется сразу
+            session_factory: Фабрика сессий для транзакций пачек
+        """
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.session_factory = session_factory
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Незавершенные фиксации пачек; ссылки нужны, чтобы задачи не собрал GC
+        self._tasks: Set[asyncio.Task] = set()
+        self.rows = 0
+        self.batches = 0
+
+    async def submit(self, row: Dict[str, Any]) -> Optional[Book]:
+        """
+        Ставит книгу в текущую пачку и ждет ее фиксации
+
+        Args:
+            row: Поля книги (title, price, description, category_id, url)
+
+        Returns:
+            Book: Созданная книга или None в случае ошибки
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._commit(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """Отправляет накопленную пачку и дожидается всех фиксаций"""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _insert(self, rows: List[Dict[str, Any]]) -> List[Optional[Book]]:
+        with self.session_factory() as db:
+            return create_books_batch(db, rows)
+
+    async def _commit(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        self.batches += 1
+        self.rows += len(batch)
+        try:
+            books = await run_in_threadpool(self._insert, [row for row, _ in batch])
+        except Exception as e:
+            print(f"Ошибка при групповой вставке книг: {e}")
+            books = [None] * len(batch)
+        for (_, future), book in zip(batch, books):
+            if not future.done():
+                future.set_result(book)
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает счетчики пачек"""
+        return {
+            "enabled": True,
+            "window_ms": self.window * 1000,
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch": round(self.rows / self.batches, 2) if self.batches else 0,
+            "pending": len(self._pending),
+            "committing": len(self._tasks),
+        }
+
+
+_committer = GroupCommitter(GROUP_COMMIT_MS, GROUP_COMMIT_MAX) if GROUP_COMMIT_MS > 0 else None
+
+
+def group_commit_enabled() -> bool:
+    """Включен ли режим групповой фиксации"""
+    return _committer is not None
+
+
+async def create_book_grouped(
+    title: str,
+    price: float,
+    description: Optional[str] = None,
+    category_id: Optional[int] = None,
+    url: str = ''
+) -> Optional[Book]:
+    """Создает книгу в составе ближайшей пачки (аргументы как у crud.create_book)"""
+    return await _committer.submit({
+        "title": title,
+        "price": price,
+        "description": description,
+        "category_id": category_id,
+        "url": url,
+    })
+
+
+async def stop_group_commit():
+    """Дожидается фиксации всех пачек (при остановке приложения)"""
+    if _committer is not None:
+        await _committer.close()
+
+
+def get_group_commit_stats() -> Dict[str, Any]:
+    """Возвращает статистику групповой фиксации в текущем процессе"""
+    if _committer is None:
+        return {"enabled": False}
+    return _committer.stats()
@@ -1,7 +1,23 @@
-from sqlalchemy import Column, Integer, String, Text, Numeric, DateTime, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Text, Numeric, DateTime, ForeignKey, Index, LargeBinary, Sequence, DDL, Float, Boolean, JSON, event, text, select, literal
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.db import Base, engine
+import os
+
+# Секционирование таблицы books: "" - нет, "hash" - по id, "list" - по category_id
+BOOKS_PARTITIONING = os.getenv("BOOKS_PARTITIONING", "").lower()
+BOOKS_HASH_PARTITIONS = int(os.getenv("BOOKS_HASH_PARTITIONS", "16"))
+
+books_id_seq = Sequence("books_id_seq")
+
+def _books_table_args():
+    """Возвращает __table_args__ для books с учетом режима секционирования"""
+    args = (Index("idx_books_category", "category_id"),)
+    if BOOKS_PARTITIONING == "hash":
+        return args + ({"postgresql_partition_by": "HASH (id)"},)
+    if BOOKS_PARTITIONING == "list":
+        return args + ({"postgresql_partition_by": "LIST (category_id)"},)
+    return args
 
 class Category(Base):
     """Модель категории книг"""
@@ -9,19 +25,53 @@ class Category(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False, unique=True, index=True)
+    # Родительская категория; поддерево хранится в таблице category_closure
+    parent_id = Column(Integer, ForeignKey("categories.id", ondelete="SET NULL"), nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     
-    books = relationship("Book", back_populates="category", cascade="save-update")
+    # passive_deletes: при удалении категории книги не загружаются,
+    # их category_id обнуляет сама БД (ondelete="SET NULL")
+    books = relationship("Book", back_populates="category", cascade="save-update", passive_deletes=True)
     
     def __repr__(self):
         return f"<Category(id={self.id}, title='{self.title}')>"
 
+class CategoryClosure(Base):
+    """
+    Замыкание дерева категорий: строка на каждую пару (предок, потомок),
+    включая саму категорию с depth=0. Книги поддерева выбираются одним
+    соединением по ancestor_id, без рекурсивных запросов
+    """
+    __tablename__ = "category_closure"
+    
+    ancestor_id = Column(Integer, ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+    
+    __table_args__ = (Index("idx_category_closure_descendant", "descendant_id", "ancestor_id"),)
+    
+    def __repr__(self):
+        return f"<CategoryClosure(ancestor_id={self.ancestor_id}, descendant_id={self.descendant_id}, depth={self.depth})>"
+
 class Book(Base):
     """Модель книги"""
     __tablename__ = "books"
     
-    id = Column(Integer, primary_key=True, index=True)
+    if BOOKS_PARTITIONING == "list":
+        # Первичный ключ секционированной таблицы должен включать category_id,
+        # а он может быть NULL. Поэтому id уникален за счет последовательности,
+        # а первичным ключом он объявлен только для ORM. insert_sentinel нужен
+        # для многострочного INSERT ... RETURNING с сохранением порядка строк
+        # (crud.create_books_batch): без ключа таблицы SQLAlchemy иначе
+        # отправляет строки по одной
+        id = Column(
+            Integer, books_id_seq, server_default=books_id_seq.next_value(),
+            nullable=False, index=True, insert_sentinel=True
+        )
+        __mapper_args__ = {"primary_key": [id]}
+    else:
+        id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False, index=True)
     description = Column(Text, nullable=True)
     price = Column(Numeric(10, 2), nullable=False)
@@ -33,13 +83,132 @@ class Book(Base):
     
     category = relationship("Category", back_populates="books")
     
-    __table_args__ = (
-        Index("idx_books_category", "category_id"),
-    )
+    __table_args__ = _books_table_args()
     
     def __repr__(self):
         return f"<Book(id={self.id}, title='{self.title}', price={self.price})>"
 
+class BookSimilarity(Base):
+    """Предрассчитанные похожие книги (заполняется app.similarity)"""
+    __tablename__ = "book_similarities"
+    
+    # Без внешнего ключа: в режиме BOOKS_PARTITIONING=list у books.id нет уникального ограничения
+    book_id = Column(Integer, primary_key=True)
+    # Упакованные массивы: id похожих книг (int32) и их сходство (float32), по убыванию сходства
+    similar_ids = Column(LargeBinary, nullable=False)
+    scores = Column(LargeBinary, nullable=False)
+    computed_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<BookSimilarity(book_id={self.book_id})>"
+
+class SimilarityRun(Base):
+    """Завершенный расчет похожих книг: от его начала отсчитывается инкрементальный режим"""
+    __tablename__ = "similarity_runs"
+    
+    id = Column(Integer, primary_key=True)
+    started_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    finished_at = Column(DateTime(timezone=True), nullable=False)
+    full = Column(Boolean, nullable=False, default=False)
+    books = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<SimilarityRun(id={self.id}, started_at={self.started_at})>"
+
+class Job(Base):
+    """Модель фоновой задачи (выполняется app.jobs)"""
+    __tablename__ = "jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)
+    # pending -> running -> succeeded / failed / cancelled
+    status = Column(String(20), nullable=False, default="pending", index=True)
+    params = Column(JSON, nullable=True)
+    # Объемные входные данные (например, книги для import_books); в ответах
+    # API не возвращаются и удаляются, когда задачу забирают на выполнение
+    payload = Column(JSON, nullable=True)
+    progress = Column(Float, nullable=False, default=0)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # Отметка процесса, выполняющего задачу; по ней находятся задачи упавших воркеров
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    
+    def __repr__(self):
+        return f"<Job(id={self.id}, kind='{self.kind}', status='{self.status}')>"
+
+def create_category_partition(connection, category_id: int):
+    """Создает секцию books для категории (режим BOOKS_PARTITIONING=list)"""
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS books_c{int(category_id)} "
+        f"PARTITION OF books FOR VALUES IN ({int(category_id)})"
+    ))
+
+@event.listens_for(Book.__table__, "after_create")
+def create_book_partitions(target, connection, **kw):
+    """Создает секции books сразу после создания секционированной таблицы"""
+    if BOOKS_PARTITIONING == "hash":
+        for remainder in range(BOOKS_HASH_PARTITIONS):
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS books_p{remainder} PARTITION OF books "
+                f"FOR VALUES WITH (MODULUS {BOOKS_HASH_PARTITIONS}, REMAINDER {remainder})"
+            ))
+    elif BOOKS_PARTITIONING == "list":
+        # Книги без категории и категорий без своей секции
+        connection.execute(text("CREATE TABLE IF NOT EXISTS books_default PARTITION OF books DEFAULT"))
+        for (category_id,) in connection.execute(text("SELECT id FROM categories")):
+            create_category_partition(connection, category_id)
+
+@event.listens_for(Category, "after_insert")
+def add_category_to_closure(mapper, connection, target):
+    """Новая категория получает строки замыкания: себя и всех предков родителя"""
+    closure = CategoryClosure.__table__
+    connection.execute(closure.insert().values(
+        ancestor_id=target.id, descendant_id=target.id, depth=0
+    ))
+    if target.parent_id is not None:
+        connection.execute(closure.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(closure.c.ancestor_id, literal(target.id), closure.c.depth + 1)
+            .where(closure.c.descendant_id == target.parent_id)
+        ))
+
+# Материализованное представление со статистикой цен по категориям
+# (обновляется app.db.stats, читается эндпоинтом GET /categories/stats)
+CATEGORY_STATS_VIEW = "category_price_stats"
+
+CREATE_CATEGORY_STATS_VIEW = f"""
+CREATE MATERIALIZED VIEW IF NOT EXISTS {CATEGORY_STATS_VIEW} AS
+SELECT
+    c.id AS category_id,
+    c.title AS title,
+    count(b.id) AS books_count,
+    min(b.price) AS min_price,
+    max(b.price) AS max_price,
+    round(avg(b.price), 2) AS avg_price,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY b.price) AS median_price,
+    percentile_cont(0.9) WITHIN GROUP (ORDER BY b.price) AS p90_price,
+    now() AS refreshed_at
+FROM categories c
+LEFT JOIN books b ON b.category_id = c.id
+GROUP BY c.id, c.title
+"""
+
+# Уникальный индекс нужен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE_CATEGORY_STATS_INDEX = (
+    f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{CATEGORY_STATS_VIEW}_category "
+    f"ON {CATEGORY_STATS_VIEW} (category_id)"
+)
+
+DROP_CATEGORY_STATS_VIEW = f"DROP MATERIALIZED VIEW IF EXISTS {CATEGORY_STATS_VIEW}"
+
+event.listen(Base.metadata, "after_create", DDL(CREATE_CATEGORY_STATS_VIEW).execute_if(dialect="postgresql"))
+event.listen(Base.metadata, "after_create", DDL(CREATE_CATEGORY_STATS_INDEX).execute_if(dialect="postgresql"))
+event.listen(Base.metadata, "before_drop", DDL(DROP_CATEGORY_STATS_VIEW).execute_if(dialect="postgresql"))
+
 def create_tables():
     """Создает все таблицы в базе данных"""
     try:
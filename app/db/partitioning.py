@@ -0,0 +1,207 @@
+"""
+Перевод существующей таблицы books в секционированную
+
+Режим задается переменной BOOKS_PARTITIONING (см. app.db.models):
+    hash - секции по хэшу id (BOOKS_HASH_PARTITIONS штук); поиск по id
+           затрагивает одну секцию, обслуживание (VACUUM, перестройка индексов)
+           идет по небольшим секциям
+    list - секция на каждую категорию плюс books_default для книг без
+           категории; запросы с фильтром по category_id читают одну секцию
+
+В режиме list секции новых категорий создаются не при вставке категории
+(CREATE TABLE ... PARTITION OF блокирует books целиком и проверяет
+books_default), а отдельно - sync_category_partitions: таблица секции
+создается и заполняется книгами категории из books_default, затем
+присоединяется: ATTACH PARTITION не блокирует books целиком, а
+books_default блокируется только на время проверки и не дольше
+SYNC_LOCK_TIMEOUT ожидания. Секции удаленных категорий удаляются. Синхронизацию запускает задача
+partition_sync после создания и удаления категорий; ее можно запустить
+и вручную (--sync).
+
+Миграция выполняется в одной транзакции: старая таблица переименовывается
+в books_legacy, создается секционированная books с секциями, данные
+копируются, последовательность id продолжается с максимального id.
+
+Запуск: BOOKS_PARTITIONING=hash python -m app.db.partitioning [--drop-legacy]
+       BOOKS_PARTITIONING=list python -m app.db.partitioning --sync
+"""
+import re
+import sys
+from typing import Dict
+
+from sqlalchemy import text
+
+from app.db.db import engine
+from app.db.models import (
+    BOOKS_PARTITIONING,
+    CREATE_CATEGORY_STATS_INDEX,
+    CREATE_CATEGORY_STATS_VIEW,
+    DROP_CATEGORY_STATS_VIEW,
+    Book,
+)
+
+BOOK_COLUMNS = "id, title, description, price, url, category_id, created_at, updated_at"
+
+# Индексы и последовательность старой таблицы переименовываются,
+# чтобы их имена заняла новая таблица
+LEGACY_RENAMES = [
+    "ALTER TABLE books RENAME TO books_legacy",
+    "ALTER INDEX IF EXISTS books_pkey RENAME TO books_legacy_pkey",
+    "ALTER INDEX IF EXISTS ix_books_id RENAME TO ix_books_legacy_id",
+    "ALTER INDEX IF EXISTS ix_books_title RENAME TO ix_books_legacy_title",
+    "ALTER INDEX IF EXISTS idx_books_category RENAME TO idx_books_legacy_category",
+    "ALTER SEQUENCE IF EXISTS books_id_seq RENAME TO books_legacy_id_seq",
+]
+
+
+# Синхронизацию секций выполняет один процесс за раз
+_SYNC_LOCK_KEY = 735003
+# Сколько ждать блокировок при изменении секций: лучше повторить позже, чем копить очередь запросов
+SYNC_LOCK_TIMEOUT = "5s"
+
+_CATEGORY_PARTITION_RE = re.compile(r"^books_c(\d+)$")
+
+
+def is_books_partitioned(conn) -> bool:
+    """Проверяет, секционирована ли уже таблица books"""
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'books'"
+    )).scalar())
+
+
+def migrate_books_to_partitioned(drop_legacy: bool = False) -> bool:
+    """
+    Переводит books в секционированную таблицу
+
+    Args:
+        drop_legacy: Удалить books_legacy после копирования
+
+    Returns:
+        bool: True если миграция выполнена, False если она не нужна или ошибка
+    """
+    if BOOKS_PARTITIONING not in ("hash", "list"):
+        print("Задайте BOOKS_PARTITIONING=hash или BOOKS_PARTITIONING=list")
+        return False
+
+    try:
+        with engine.begin() as conn:
+            if is_books_partitioned(conn):
+                print("Таблица books уже секционирована")
+                return False
+
+            # Представление ссылается на старую таблицу и пересоздается после переноса
+            conn.execute(text(DROP_CATEGORY_STATS_VIEW))
+
+            for statement in LEGACY_RENAMES:
+                conn.execute(text(statement))
+
+            # Создание таблицы запускает create_book_partitions из app.db.models
+            Book.__table__.create(conn)
+
+            conn.execute(text(
+                f"INSERT INTO books ({BOOK_COLUMNS}) SELECT {BOOK_COLUMNS} FROM books_legacy"
+            ))
+            conn.execute(text(
+                "SELECT setval('books_id_seq', COALESCE((SELECT max(id) FROM books), 0) + 1, false)"
+            ))
+
+            conn.execute(text(CREATE_CATEGORY_STATS_VIEW))
+            conn.execute(text(CREATE_CATEGORY_STATS_INDEX))
+
+            if drop_legacy:
+                conn.execute(text("DROP TABLE books_legacy"))
+
+            count = conn.execute(text("SELECT count(*) FROM books")).scalar()
+
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE books"))
+
+        print(f"Таблица books секционирована ({BOOKS_PARTITIONING}), перенесено книг: {count}")
+        return True
+    except Exception as e:
+        print(f"Ошибка при секционировании таблицы books: {e}")
+        return False
+
+
+def _attach_category_partition(conn, category_id: int):
+    """Создает секцию категории, переносит в нее книги из books_default и присоединяет ее"""
+    name = f"books_c{int(category_id)}"
+    conn.execute(text(f"SET LOCAL lock_timeout = '{SYNC_LOCK_TIMEOUT}'"))
+    conn.execute(text(f"CREATE TABLE {name} (LIKE books INCLUDING DEFAULTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM books_default WHERE category_id = {int(category_id)} RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ))
+    # Ограничение избавляет ATTACH от проверки всей секции
+    conn.execute(text(
+        f"ALTER TABLE {name} ADD CONSTRAINT {name}_category "
+        f"CHECK (category_id IS NOT NULL AND category_id = {int(category_id)})"
+    ))
+    conn.execute(text(f"ALTER TABLE books ATTACH PARTITION {name} FOR VALUES IN ({int(category_id)})"))
+    conn.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_category"))
+
+
+def sync_category_partitions() -> Dict[str, int]:
+    """
+    Создает недостающие секции категорий и удаляет секции удаленных (режим list)
+
+    Каждая секция создается в своей транзакции. Книг в секции удаленной
+    категории нет: их category_id обнулило ограничение ondelete="SET NULL",
+    и они перешли в books_default.
+
+    Returns:
+        Dict[str, int]: Число созданных (created) и удаленных (dropped) секций
+    """
+    result = {"created": 0, "dropped": 0}
+    if BOOKS_PARTITIONING != "list":
+        return result
+
+    # Блокировка, список секций и все изменения - на одном соединении:
+    # синхронизация не занимает из пула больше одного соединения
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _SYNC_LOCK_KEY}).scalar():
+            conn.commit()
+            return result
+        conn.commit()
+        try:
+            partitions = {
+                int(match.group(1))
+                for (name,) in conn.execute(text(
+                    "SELECT c.relname FROM pg_inherits i "
+                    "JOIN pg_class c ON c.oid = i.inhrelid "
+                    "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'books'"
+                ))
+                if (match := _CATEGORY_PARTITION_RE.match(name))
+            }
+            categories = set(conn.execute(text("SELECT id FROM categories")).scalars())
+            conn.commit()
+
+            for category_id in sorted(categories - partitions):
+                try:
+                    with conn.begin():
+                        _attach_category_partition(conn, category_id)
+                    result["created"] += 1
+                except Exception as e:
+                    print(f"Ошибка при создании секции books_c{category_id}: {e}")
+
+            for category_id in sorted(partitions - categories):
+                try:
+                    with conn.begin():
+                        conn.execute(text(f"SET LOCAL lock_timeout = '{SYNC_LOCK_TIMEOUT}'"))
+                        conn.execute(text(f"DROP TABLE books_c{int(category_id)}"))
+                    result["dropped"] += 1
+                except Exception as e:
+                    print(f"Ошибка при удалении секции books_c{category_id}: {e}")
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _SYNC_LOCK_KEY})
+            conn.commit()
+    return result
+
+
+if __name__ == "__main__":
+    if "--sync" in sys.argv:
+        print(f"Секции категорий: {sync_category_partitions()}")
+    else:
+        migrate_books_to_partitioned(drop_legacy="--drop-legacy" in sys.argv)
@@ -0,0 +1,158 @@
+"""
+Журнал медленных запросов с автоматическим EXPLAIN
+
+Запросы к db.engine дольше порога пишутся в логгер "app.db.slow_query":
+SQL, параметры (значения скрыты), длительность и маршрут, из которого
+пришел запрос. Для части медленных SELECT в фоне снимается
+EXPLAIN (ANALYZE, BUFFERS).
+
+Логирование идет через очередь (QueueHandler/QueueListener), поэтому
+обработчик запроса никогда не ждет вывода в stdout.
+
+Настройки через переменные окружения:
+    DB_SLOW_QUERY_MS            - порог в миллисекундах (не задан - журнал выключен)
+    DB_SLOW_QUERY_EXPLAIN_RATE  - доля медленных SELECT для EXPLAIN (по умолчанию 0.1)
+"""
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from sqlalchemy import event
+
+from app.db.db import engine
+
+SLOW_QUERY_MS = os.getenv("DB_SLOW_QUERY_MS")
+EXPLAIN_RATE = float(os.getenv("DB_SLOW_QUERY_EXPLAIN_RATE", "0.1"))
+
+logger = logging.getLogger("app.db.slow_query")
+
+# Маршрут текущего HTTP-запроса, выставляется middleware в app.main
+current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_explain_queue: "queue.Queue" = queue.Queue(maxsize=100)
+_explain_thread: Optional[threading.Thread] = None
+
+
+def redact_parameters(parameters: Any) -> Any:
+    """Заменяет значения параметров их типами, чтобы данные не попадали в лог"""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_parameters(value) for value in parameters]
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["slow_query_start"].pop()
+    duration_ms = (time.perf_counter() - started) * 1000
+    if duration_ms < float(SLOW_QUERY_MS):
+        return
+    if context is not None and context.execution_options.get("skip_slow_query_log"):
+        return
+
+    logger.warning(
+        "Медленный запрос %.1f мс [%s]: %s | параметры: %s",
+        duration_ms,
+        current_route.get() or "-",
+        statement,
+        redact_parameters(parameters),
+    )
+
+    if (
+        not executemany
+        and statement.lstrip().upper().startswith("SELECT")
+        and random.random() < EXPLAIN_RATE
+    ):
+        try:
+            _explain_queue.put_nowait((statement, parameters))
+        except queue.Full:
+            pass
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    starts = conn.info.get("slow_query_start") if conn is not None else None
+    if starts:
+        starts.pop()
+
+
+def _explain_worker():
+    """Снимает планы медленных запросов в отдельном соединении"""
+    while True:
+        item = _explain_queue.get()
+        if item is None:
+            return
+        statement, parameters = item
+        try:
+            with engine.connect() as conn:
+                conn = conn.execution_options(skip_slow_query_log=True)
+                result = conn.exec_driver_sql(
+                    "EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters
+                )
+                plan = "\n".join(row[0] for row in result)
+                conn.rollback()
+            logger.warning("План медленного запроса:\n%s\n%s", statement, plan)
+        except Exception as e:
+            logger.warning("Ошибка при получении плана запроса: %s", e)
+
+
+def start_slow_query_log() -> bool:
+    """
+    Включает журнал медленных запросов в текущем процессе
+
+    Вызывается из lifespan приложения, то есть уже в воркере после fork:
+    потоки, запущенные до fork, в дочерний процесс не переходят.
+
+    Returns:
+        bool: True если журнал включен, False если порог не задан
+    """
+    global _listener, _explain_thread
+    if not SLOW_QUERY_MS:
+        return False
+
+    log_queue: "queue.Queue" = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(name)s: %(message)s"))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+
+    _explain_thread = threading.Thread(target=_explain_worker, daemon=True)
+    _explain_thread.start()
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    return True
+
+
+def stop_slow_query_log():
+    """Выключает журнал и дописывает оставшиеся записи"""
+    global _listener, _explain_thread
+    if _listener is None:
+        return
+
+    event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+    event.remove(engine, "handle_error", _handle_error)
+
+    _explain_queue.put(None)
+    _explain_thread.join(timeout=5)
+    _explain_thread = None
+
+    _listener.stop()
+    _listener = None
+    logger.handlers.clear()
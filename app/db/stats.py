@@ -0,0 +1,103 @@
+"""
+Обновление материализованного представления со статистикой по категориям
+
+Представление category_price_stats (см. app.db.models) обновляется
+командой REFRESH MATERIALIZED VIEW CONCURRENTLY, не блокирующей чтение:
+раз в CATEGORY_STATS_REFRESH_SECONDS секунд или раньше, если с прошлого
+обновления в книгах и категориях накопилось CATEGORY_STATS_REFRESH_WRITES
+изменений. Обновление идет в фоновом потоке; при нескольких воркерах его
+выполняет только один из них (advisory lock).
+"""
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy import event, text
+
+from app.db.db import engine
+from app.db.models import CATEGORY_STATS_VIEW, Book, Category
+
+REFRESH_SECONDS = float(os.getenv("CATEGORY_STATS_REFRESH_SECONDS", "300"))
+REFRESH_WRITES = int(os.getenv("CATEGORY_STATS_REFRESH_WRITES", "1000"))
+
+# Произвольный ключ advisory lock для обновления представления
+_REFRESH_LOCK_KEY = 735001
+
+_writes = 0
+_writes_lock = threading.Lock()
+_wakeup = threading.Event()
+_stopping = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def note_writes(count: int = 1):
+    """Учитывает изменения книг или категорий; при превышении порога будит поток обновления"""
+    global _writes
+    with _writes_lock:
+        _writes += count
+        if _writes >= REFRESH_WRITES:
+            _wakeup.set()
+
+
+def _on_write(mapper, connection, target):
+    note_writes()
+
+
+for _model in (Book, Category):
+    for _event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event_name, _on_write)
+
+
+def refresh_category_stats() -> bool:
+    """
+    Обновляет представление category_price_stats
+
+    Returns:
+        bool: True если обновлено, False если его уже обновляет другой процесс или ошибка
+    """
+    global _writes
+    try:
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            locked = conn.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": _REFRESH_LOCK_KEY}
+            ).scalar()
+            if not locked:
+                return False
+            try:
+                with _writes_lock:
+                    _writes = 0
+                conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {CATEGORY_STATS_VIEW}"))
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _REFRESH_LOCK_KEY})
+        return True
+    except Exception as e:
+        print(f"Ошибка при обновлении статистики категорий: {e}")
+        return False
+
+
+def _refresh_loop():
+    while not _stopping.is_set():
+        _wakeup.wait(REFRESH_SECONDS)
+        _wakeup.clear()
+        if not _stopping.is_set():
+            refresh_category_stats()
+
+
+def start_category_stats_refresh():
+    """Запускает фоновое обновление (вызывается из lifespan, то есть в воркере)"""
+    global _thread
+    _stopping.clear()
+    _thread = threading.Thread(target=_refresh_loop, daemon=True)
+    _thread.start()
+
+
+def stop_category_stats_refresh():
+    """Останавливает фоновое обновление"""
+    global _thread
+    if _thread is None:
+        return
+    _stopping.set()
+    _wakeup.set()
+    _thread.join(timeout=5)
+    _thread = None
@@ -0,0 +1,190 @@
+"""
+Компактные форматы ответов для больших списков
+
+Для списочных эндпоинтов формат выбирается по заголовку Accept:
+    application/json                       - обычный JSON (по умолчанию)
+    application/vnd.bookstore.columnar+json - колоночный JSON: имена полей один раз,
+                                              значения каждого поля - массивом
+    application/msgpack                    - MessagePack (если установлен msgpack)
+
+Ответ больше COMPRESSION_MIN_SIZE байт сжимается brotli (если установлен brotli)
+или gzip в зависимости от Accept-Encoding. Веса q в обоих заголовках
+учитываются: q=0 исключает значение, из поддерживаемых выбирается самое
+предпочтительное. Сериализация и сжатие выполняются в пуле потоков.
+"""
+import gzip
+import json
+import os
+from typing import Any, Dict, Iterable, List, Tuple, Type
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.bookstore.columnar+json"
+MSGPACK = "application/msgpack"
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+
+def to_rows(items: Iterable[Any], schema: Type[BaseModel]) -> List[Dict[str, Any]]:
+    """Преобразует объекты (ORM или словари) в список словарей по схеме ответа"""
+    return [schema.model_validate(item).model_dump(mode="json") for item in items]
+
+
+def serialize(rows: List[Dict[str, Any]], fields: List[str], media_type: str) -> bytes:
+    """
+    Сериализует строки в выбранный формат
+
+    Args:
+        rows: Строки ответа
+        fields: Имена полей в порядке схемы
+        media_type: Формат (JSON, COLUMNAR_JSON или MSGPACK)
+
+    Returns:
+        bytes: Тело ответа
+    """
+    if media_type == COLUMNAR_JSON:
+        payload = {
+            "count": len(rows),
+            "columns": {field: [row[field] for row in rows] for field in fields},
+        }
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+    if media_type == MSGPACK:
+        return msgpack.packb(rows)
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Сжимает тело ответа ("br" или "gzip")"""
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+
+def parse_weights(header: str) -> Dict[str, float]:
+    """
+    Разбирает заголовок вида "a;q=0.5, b" в словарь {значение: q}
+
+    Значение без q получает вес 1; некорректный q считается нулем
+    """
+    weights = {}
+    for part in header.split(","):
+        value, *params = [item.strip() for item in part.split(";")]
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, raw = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = min(max(float(raw), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        weights[value.lower()] = max(q, weights.get(value.lower(), 0.0))
+    return weights
+
+
+def negotiate_media_type(accept: str) -> str:
+    """
+    Выбирает формат ответа по заголовку Accept
+
+    Точное совпадение важнее application/* и */*; при равных весах из явно
+    названных форматов предпочитаются компактные, по шаблону - JSON.
+    Если ни один формат не принят (или заголовка нет) - JSON
+    """
+    weights = parse_weights(accept)
+    if not weights:
+        return JSON
+    aliases = {MSGPACK: (MSGPACK, "application/x-msgpack")}
+    candidates = [COLUMNAR_JSON] + ([MSGPACK] if msgpack is not None else []) + [JSON]
+    best, best_score = JSON, None
+    for preference, media_type in enumerate(reversed(candidates)):
+        names = [name for name in aliases.get(media_type, (media_type,)) if name in weights]
+        if names:
+            score = (max(weights[name] for name in names), 2, preference)
+        elif "application/*" in weights:
+            score = (weights["application/*"], 1, media_type == JSON)
+        elif "*/*" in weights:
+            score = (weights["*/*"], 0, media_type == JSON)
+        else:
+            continue
+        if score[0] > 0 and (best_score is None or score > best_score):
+            best, best_score = media_type, score
+    return best
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    Выбирает сжатие по заголовку Accept-Encoding ("" - без сжатия)
+
+    Из br и gzip берется кодирование с наибольшим весом (при равных - br);
+    сжатие не выбирается, если явно указанный identity весит больше
+    """
+    weights = parse_weights(accept_encoding)
+    wildcard = weights.get("*", 0.0)
+    best, best_q = "", weights.get("identity", 0.0)
+    for encoding in (["br"] if brotli is not None else []) + ["gzip"]:
+        q = weights.get(encoding, wildcard)
+        if q > 0 and q > best_q:
+            best, best_q = encoding, q
+        elif q > 0 and q == best_q and not best:
+            best = encoding
+    return best
+
+
+def encode_body(items: Iterable[Any], schema: Type[BaseModel], media_type: str, encoding: str) -> Tuple[bytes, str]:
+    """
+    Сериализует и при необходимости сжимает тело ответа (блокирующая работа)
+
+    Returns:
+        Tuple[bytes, str]: Тело и примененное сжатие ("" - без сжатия)
+    """
+    body = serialize(to_rows(items, schema), list(schema.model_fields), media_type)
+    if encoding and len(body) >= COMPRESSION_MIN_SIZE:
+        return compress(body, encoding), encoding
+    return body, ""
+
+
+async def encode_response(request: Request, items: Iterable[Any], schema: Type[BaseModel]) -> Response:
+    """
+    Формирует ответ со списком объектов в формате, запрошенном клиентом
+
+    Сериализация и сжатие больших списков идут в пуле потоков, чтобы не
+    занимать цикл событий
+
+    Args:
+        request: Текущий запрос (заголовки Accept и Accept-Encoding)
+        items: Объекты для ответа
+        schema: Pydantic-схема одного элемента
+
+    Returns:
+        Response: Готовый ответ
+    """
+    media_type = negotiate_media_type(request.headers.get("accept", ""))
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    body, encoding = await run_in_threadpool(encode_body, items, schema, media_type, encoding)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def available_formats() -> List[Tuple[str, str]]:
+    """Возвращает пары (формат, сжатие), доступные в текущем окружении"""
+    media_types = [JSON, COLUMNAR_JSON] + ([MSGPACK] if msgpack is not None else [])
+    encodings = ["", "gzip"] + (["br"] if brotli is not None else [])
+    return [(media_type, encoding) for media_type in media_types for encoding in encodings]
@@ -0,0 +1,395 @@
+"""
+Фоновые задачи для тяжелых операций с каталогом
+
+Задача создается через POST /jobs, сохраняется в таблице jobs и
+выполняется в ограниченном пуле потоков (JOB_WORKERS) того воркера,
+который ее принял. Запрос сразу получает 202, а статус и прогресс
+читаются через GET /jobs/{id}, причем из любого воркера. Отмена
+(POST /jobs/{id}/cancel) выставляет флаг в БД, который задача проверяет
+при каждом обновлении прогресса.
+
+Типы задач регистрируются декоратором job_handler. Объемные входные
+данные (JOB_PAYLOAD_KEYS, например список книг import_books) хранятся
+отдельно от params и удаляются, когда задачу забирают на выполнение;
+в params остается только их размер.
+
+Задачи переживают перезапуск: процесс раз в JOB_HEARTBEAT_SECONDS
+отмечает свои выполняющиеся задачи, а при запуске и затем периодически
+переводит в failed задачи running без отметки дольше JOB_STALE_SECONDS
+(их воркер остановился) и ставит в свою очередь задачи pending, которые
+никто не забрал за это время.
+
+Настройки через переменные окружения:
+    JOB_WORKERS            - число потоков для задач (по умолчанию 2)
+    JOB_QUEUE_SIZE         - максимум задач в очереди процесса (по умолчанию 100)
+    JOB_EXPORT_DIR         - каталог для выгрузок (по умолчанию exports)
+    JOB_HEARTBEAT_SECONDS  - период отметок и восстановления задач (по умолчанию 30)
+    JOB_STALE_SECONDS      - когда задача считается брошенной (по умолчанию 120)
+"""
+import csv
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import func, inspect, or_, select, text, update
+
+from app.db.crud import count_books
+from app.db.db import SessionLocal, engine
+from app.db.models import Book, Job
+from app.db.stats import refresh_category_stats
+from app.schemas import BookCreate
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_EXPORT_DIR = os.getenv("JOB_EXPORT_DIR", "exports")
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+
+# Параметры, которые хранятся в jobs.payload, а не в jobs.params
+JOB_PAYLOAD_KEYS: Dict[str, str] = {
+    "import_books": "books",
+}
+
+ADD_JOB_COLUMNS = [
+    "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS payload JSON",
+    "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE",
+]
+
+# Прогресс пишется в БД не чаще, чем раз в столько секунд
+PROGRESS_INTERVAL = 0.5
+# Размер пачки export_books
+EXPORT_BATCH_SIZE = 1000
+
+JOB_HANDLERS: Dict[str, Callable[["JobContext"], Any]] = {}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_queued = 0
+_queued_lock = threading.Lock()
+# Задачи, стоящие в очереди или выполняющиеся в этом процессе
+_submitted: Set[int] = set()
+_running: Set[int] = set()
+
+_maintenance_thread: Optional[threading.Thread] = None
+_stopping = threading.Event()
+
+
+class JobQueueFull(Exception):
+    """Очередь задач процесса заполнена"""
+
+
+def job_handler(kind: str):
+    """Регистрирует функцию как обработчик задач типа kind"""
+    def decorator(func: Callable[["JobContext"], Any]):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+class JobContext:
+    """Параметры выполняющейся задачи, прогресс и проверка отмены"""
+
+    def __init__(self, job_id: int, params: Dict[str, Any]):
+        self.job_id = job_id
+        self.params = params
+        self.cancelled = False
+        self._last_update = 0.0
+
+    def progress(self, done: int, total: int) -> bool:
+        """
+        Сохраняет прогресс задачи
+
+        Args:
+            done: Сколько обработано
+            total: Сколько всего
+
+        Returns:
+            bool: False если задачу отменили и ее нужно остановить
+        """
+        now = time.monotonic()
+        if now - self._last_update < PROGRESS_INTERVAL and done < total:
+            return not self.cancelled
+        self._last_update = now
+
+        with SessionLocal() as db:
+            db.execute(
+                update(Job).where(Job.id == self.job_id)
+                .values(progress=done / total if total else 1.0)
+            )
+            db.commit()
+            self.cancelled = bool(db.execute(
+                select(Job.cancel_requested).where(Job.id == self.job_id)
+            ).scalar())
+        return not self.cancelled
+
+
+def _finish(job_id: int, **values):
+    with SessionLocal() as db:
+        db.execute(update(Job).where(Job.id == job_id).values(finished_at=func.now(), **values))
+        db.commit()
+
+
+def _run(job_id: int):
+    global _queued
+    with _queued_lock:
+        _queued -= 1
+    try:
+        _execute(job_id)
+    except Exception as e:
+        # Исключения из пула потоков иначе никто не увидит
+        print(f"Ошибка при выполнении задачи {job_id}: {e}")
+    finally:
+        with _queued_lock:
+            _submitted.discard(job_id)
+            _running.discard(job_id)
+
+
+def _execute(job_id: int):
+    # Задачу забирает только один процесс; отмененные до старта пропускаются
+    with SessionLocal() as db:
+        claimed = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "pending")
+            .values(status="running", started_at=func.now(), heartbeat_at=func.now())
+            .returning(Job.kind, Job.params)
+        ).first()
+        payload = None
+        if claimed is not None and claimed.kind in JOB_PAYLOAD_KEYS:
+            # RETURNING вернул бы уже обновленную строку, поэтому данные читаются до очистки
+            payload = db.execute(select(Job.payload).where(Job.id == job_id)).scalar()
+            db.execute(update(Job).where(Job.id == job_id).values(payload=None))
+        db.commit()
+    if claimed is None:
+        return
+    with _queued_lock:
+        _running.add(job_id)
+
+    context = JobContext(job_id, {**(claimed.params or {}), **(payload or {})})
+    try:
+        result = JOB_HANDLERS[claimed.kind](context)
+    except Exception as e:
+        print(f"Ошибка в задаче {job_id} ({claimed.kind}): {e}")
+        _finish(job_id, status="failed", error=str(e))
+        return
+
+    if context.cancelled:
+        _finish(job_id, status="cancelled", result=result)
+    else:
+        _finish(job_id, status="succeeded", progress=1.0, result=result)
+
+
+def submit_job(job_id: int):
+    """
+    Ставит сохраненную задачу в очередь процесса
+
+    Raises:
+        JobQueueFull: Если в очереди уже JOB_QUEUE_SIZE задач
+    """
+    global _queued
+    if _executor is None:
+        raise RuntimeError("Пул фоновых задач не запущен")
+    with _queued_lock:
+        if _queued >= JOB_QUEUE_SIZE:
+            raise JobQueueFull()
+        _queued += 1
+        _submitted.add(job_id)
+    _executor.submit(_run, job_id)
+
+
+def split_job_params(kind: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Отделяет объемные входные данные задачи от параметров
+
+    Returns:
+        Tuple: (params со счетчиком вместо данных, payload или None)
+    """
+    key = JOB_PAYLOAD_KEYS.get(kind)
+    if key is None or key not in params:
+        return params, None
+    summary = {name: value for name, value in params.items() if name != key}
+    summary[f"{key}_count"] = len(params[key])
+    return summary, {key: params[key]}
+
+
+def ensure_job_columns() -> bool:
+    """
+    Добавляет в таблицу jobs колонки payload и heartbeat_at (для баз, созданных раньше)
+
+    Returns:
+        bool: True если колонки есть, False в случае ошибки
+    """
+    try:
+        with engine.begin() as conn:
+            columns = {column["name"] for column in inspect(conn).get_columns("jobs")}
+            if not {"payload", "heartbeat_at"} <= columns:
+                for statement in ADD_JOB_COLUMNS:
+                    conn.execute(text(statement))
+                print("В таблицу jobs добавлены колонки payload и heartbeat_at")
+        return True
+    except Exception as e:
+        print(f"Ошибка при подготовке таблицы jobs: {e}")
+        return False
+
+
+def recover_jobs() -> Dict[str, int]:
+    """
+    Отмечает задачи этого процесса и подбирает брошенные
+
+    Выполняющиеся здесь задачи получают свежий heartbeat_at; задачи running
+    без отметки дольше JOB_STALE_SECONDS переводятся в failed, а задачи pending
+    старше JOB_STALE_SECONDS, которых нет в очереди процесса, ставятся в нее
+    (выполнит задачу только тот процесс, который первым ее заберет).
+
+    Returns:
+        Dict[str, int]: Число помеченных (failed) и поставленных в очередь (resubmitted) задач
+    """
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=JOB_STALE_SECONDS)
+    with _queued_lock:
+        running = list(_running)
+        submitted = set(_submitted)
+
+    with SessionLocal() as db:
+        if running:
+            db.execute(update(Job).where(Job.id.in_(running)).values(heartbeat_at=func.now()))
+        failed = db.execute(
+            update(Job)
+            .where(
+                Job.status == "running",
+                or_(
+                    Job.heartbeat_at < stale_before,
+                    Job.heartbeat_at.is_(None) & (Job.started_at < stale_before),
+                ),
+            )
+            .values(status="failed", error="Процесс, выполнявший задачу, остановился", finished_at=func.now())
+        ).rowcount
+        db.commit()
+        pending = db.execute(
+            select(Job.id)
+            .where(Job.status == "pending", Job.created_at < stale_before)
+            .order_by(Job.id)
+        ).scalars().all()
+
+    resubmitted = 0
+    for job_id in pending:
+        if job_id in submitted:
+            continue
+        try:
+            submit_job(job_id)
+        except JobQueueFull:
+            break
+        resubmitted += 1
+    if failed or resubmitted:
+        print(f"Восстановление задач: брошенных {failed}, снова в очереди {resubmitted}")
+    return {"failed": failed, "resubmitted": resubmitted}
+
+
+def _maintenance_loop():
+    while True:
+        try:
+            recover_jobs()
+        except Exception as e:
+            print(f"Ошибка при восстановлении задач: {e}")
+        if _stopping.wait(JOB_HEARTBEAT_SECONDS):
+            return
+
+
+def start_job_runner():
+    """Запускает пул задач и восстановление брошенных задач (вызывается из lifespan, то есть в воркере)"""
+    global _executor, _maintenance_thread
+    _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+    _stopping.clear()
+    _maintenance_thread = threading.Thread(target=_maintenance_loop, daemon=True)
+    _maintenance_thread.start()
+
+
+def stop_job_runner():
+    """Останавливает пул; задачи в очереди остаются в статусе pending и будут подобраны после запуска"""
+    global _executor, _maintenance_thread
+    if _executor is None:
+        return
+    _stopping.set()
+    if _maintenance_thread is not None:
+        _maintenance_thread.join(timeout=5)
+        _maintenance_thread = None
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    with _queued_lock:
+        _submitted.clear()
+
+
+@job_handler("similarity_refresh")
+def similarity_refresh_job(context: JobContext):
+    """Пересчет похожих книг; params: {"full": bool}"""
+    # NumPy и SciPy загружаются только при первом пересчете
+    from app.similarity import refresh_similar_books
+    count = refresh_similar_books(full=bool(context.params.get("full")), progress=context.progress)
+    return {"books": count}
+
+
+@job_handler("category_stats_refresh")
+def category_stats_refresh_job(context: JobContext):
+    """Обновление представления со статистикой по категориям"""
+    return {"refreshed": refresh_category_stats()}
+
+
+@job_handler("partition_sync")
+def partition_sync_job(context: JobContext):
+    """Синхронизация секций books с категориями (режим BOOKS_PARTITIONING=list)"""
+    from app.db.partitioning import sync_category_partitions
+    return sync_category_partitions()
+
+
+@job_handler("export_books")
+def export_books_job(context: JobContext):
+    """Выгрузка книг в CSV; params: {"category_id": int | None}"""
+    category_id = context.params.get("category_id")
+    os.makedirs(JOB_EXPORT_DIR, exist_ok=True)
+    path = os.path.join(JOB_EXPORT_DIR, f"books_{context.job_id}.csv")
+    columns = ["id", "title", "description", "price", "url", "category_id"]
+
+    with SessionLocal() as db, open(path, "w", newline="", encoding="utf-8") as file:
+        total = count_books(db, category_id)
+        statement = (
+            select(*[getattr(Book, column) for column in columns])
+            .order_by(Book.id)
+            .limit(EXPORT_BATCH_SIZE)
+        )
+        if category_id is not None:
+            statement = statement.where(Book.category_id == category_id)
+
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        done = 0
+        last_id = 0
+        while True:
+            # Пачки по ключу: между ними соединение возвращается в пул, и запись
+            # прогресса (своя сессия) не занимает второе соединение
+            rows = db.execute(statement.where(Book.id > last_id)).all()
+            db.commit()
+            if not rows:
+                break
+            writer.writerows(rows)
+            done += len(rows)
+            last_id = rows[-1].id
+            if not context.progress(done, total):
+                break
+    return {"path": path, "rows": done}
+
+
+@job_handler("import_books")
+def import_books_job(context: JobContext):
+    """Загрузка книг; params: {"books": [{title, price, description, url, category_id}, ...]}"""
+    books = [BookCreate.model_validate(book).model_dump() for book in context.params.get("books", [])]
+    batch_size = 1000
+    done = 0
+    with SessionLocal() as db:
+        for start in range(0, len(books), batch_size):
+            batch = books[start:start + batch_size]
+            db.add_all(Book(**book) for book in batch)
+            db.commit()
+            done += len(batch)
+            if not context.progress(done, len(books)):
+                break
+    return {"imported": done}
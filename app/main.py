@@ -1,20 +1,58 @@
+import os
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from app.api.categories import router as categories_router  
 from app.api.books import router as books_router            
+from app.api.jobs import router as jobs_router
+from app.api.debug import router as debug_router
+from app.admission import AdmissionControlMiddleware, get_admission_stats
+from app.profiling import ProfilingMiddleware
+from app.stale_cache import StaleCacheMiddleware, database_error_handler, database_unavailable_handler, get_stale_cache_stats
+from app.db.coalescing import get_coalescing_stats
+from app.db.breaker import DATABASE_UNAVAILABLE_ERRORS, DatabaseUnavailableError, breaker
 from app.db.db import test_connection
+from app.db.group_commit import get_group_commit_stats, stop_group_commit
 from app.db.models import create_tables
+from app.db.category_tree import ensure_category_tree
+from app.jobs import ensure_job_columns, start_job_runner, stop_job_runner
+from app.db.stats import start_category_stats_refresh, stop_category_stats_refresh
+from app.db.slow_query import current_route, start_slow_query_log, stop_slow_query_log
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    print(" Запуск приложения...")
+def prepare_database() -> bool:
+    """
+    Создает таблицы и дополняет схему существующей базы
+
+    При запуске через app.server вызывается один раз в мастер-процессе до fork
+
+    Returns:
+        bool: True если схема готова, False если БД недоступна или ошибка
+    """
     if not test_connection():
         print(" Внимание: Проблемы с подключением к базе данных")
-    else:
-        print(" База данных подключена")
-        create_tables()
+        return False
+    print(" База данных подключена")
+    ready = create_tables() and ensure_category_tree() and ensure_job_columns()
+    if ready:
         print(" Таблицы проверены/созданы")
+    else:
+        print(" Внимание: схема базы данных подготовлена не полностью")
+    return ready
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print(" Запуск приложения...")
+    # APP_SCHEMA_READY выставляет app.server, если схема уже готова в мастер-процессе
+    if os.getenv("APP_SCHEMA_READY") != "1":
+        prepare_database()
+    start_category_stats_refresh()
+    start_job_runner()
+    if start_slow_query_log():
+        print(" Журнал медленных запросов включен")
     yield
+    await stop_group_commit()
+    stop_slow_query_log()
+    stop_category_stats_refresh()
+    stop_job_runner()
     print(" Приложение остановлено")
 
 app = FastAPI(
@@ -25,8 +63,29 @@ app = FastAPI(
 )
 
 
+@app.middleware("http")
+async def track_route(request: Request, call_next):
+    """Запоминает маршрут запроса для журнала медленных запросов"""
+    token = current_route.set(f"{request.method} {request.url.path}")
+    try:
+        return await call_next(request)
+    finally:
+        current_route.reset(token)
+
+
+app.add_exception_handler(DatabaseUnavailableError, database_unavailable_handler)
+for _error in DATABASE_UNAVAILABLE_ERRORS:
+    if not issubclass(_error, DatabaseUnavailableError):
+        app.add_exception_handler(_error, database_error_handler)
+app.add_middleware(StaleCacheMiddleware)
+# Профилирование внутри контроля допуска: ожидание в очереди в профиль не входит
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(AdmissionControlMiddleware)
+
 app.include_router(categories_router)
 app.include_router(books_router)
+app.include_router(jobs_router)
+app.include_router(debug_router)
 
 @app.get("/")
 async def root():
@@ -38,6 +97,7 @@ async def root():
             "categories": "/categories",
             "books": "/books",
             "books/search": "/books/search?q=поиск",
+            "jobs": "/jobs",
             "health": "/health"
         }
     }
@@ -45,9 +105,18 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Проверка здоровья сервиса"""
-    db_status = "connected" if test_connection() else "disconnected"
+    # Пока выключатель разомкнут, БД не проверяется: это заняло бы таймаут подключения
+    if breaker.is_open():
+        db_status = "circuit_open"
+    else:
+        db_status = "connected" if test_connection() else "disconnected"
     return {
         "status": "healthy",
         "database": db_status,
+        "coalescing": get_coalescing_stats(),
+        "admission": get_admission_stats(),
+        "group_commit": get_group_commit_stats(),
+        "breaker": breaker.stats(),
+        "stale_cache": get_stale_cache_stats(),
         "api_version": "1.0.0"
     }
\ No newline at end of file
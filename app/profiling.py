@@ -0,0 +1,261 @@
+"""
+Профилирование отдельных запросов по требованию
+
+Запрос профилируется, если у него есть заголовок X-Profile-Token со
+значением PROFILE_TOKEN, или случайно с вероятностью PROFILE_SAMPLE_RATE.
+На время запроса запускается статистический профилировщик: он раз в
+PROFILE_INTERVAL_MS миллисекунд снимает стеки всех потоков процесса
+(cProfile видит только свой поток, а запросы к БД и обработчики
+выполняются в пуле потоков). Одновременно профилируется не больше
+одного запроса на процесс; параллельные запросы тоже попадают в
+выборку, поэтому точнее всего профиль на малонагруженном воркере.
+
+По стекам время делится на фазы:
+    db             - драйвер БД, пул соединений и выполнение SQL в SQLAlchemy;
+    orm            - построение запросов и сборка объектов ORM;
+    serialization  - проверка и сериализация Pydantic, JSON, msgpack, сжатие;
+    other          - остальное (код приложения, FastAPI, цикл событий).
+
+Профиль сохраняется в PROFILE_DIR в виде JSON (фазы и свернутые стеки);
+хранятся последние PROFILE_MAX_FILES профилей. Имя профиля возвращается
+в заголовке ответа X-Profile-Id, скачать его можно через
+GET /debug/profiles/{имя} (тоже с заголовком X-Profile-Token).
+
+Настройки через переменные окружения:
+    PROFILE_TOKEN         - токен администратора (по умолчанию пусто - профилирование
+                            по заголовку и /debug/profiles отключены)
+    PROFILE_SAMPLE_RATE   - доля случайно профилируемых запросов (по умолчанию 0)
+    PROFILE_INTERVAL_MS   - интервал снятия стеков (по умолчанию 1)
+    PROFILE_DIR           - каталог профилей (по умолчанию profiles)
+    PROFILE_MAX_FILES     - сколько профилей хранить (по умолчанию 50)
+"""
+import hmac
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+TOKEN_HEADER = b"x-profile-token"
+
+# Фаза определяется по ближайшему к вершине стека кадру из известного модуля
+PHASES = [
+    ("db", ("sqlalchemy/engine/", "sqlalchemy/pool/", "psycopg", "sqlite3/")),
+    ("orm", ("sqlalchemy/orm/", "sqlalchemy/sql/")),
+    ("serialization", (
+        "pydantic", "fastapi/encoders.py", "json/", "msgpack", "brotli",
+        "starlette/responses.py", "app/encoding.py",
+    )),
+]
+
+# Потоки, ожидающие в этих модулях, простаивают и в выборку не попадают
+IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+MAX_STACK_DEPTH = 64
+
+_PROFILE_NAME = re.compile(r"^[\w.-]+$")
+_counter = itertools.count()
+
+
+def _frame_phase(filename: str) -> Optional[str]:
+    filename = filename.replace("\\", "/")
+    for phase, patterns in PHASES:
+        if any(pattern in filename for pattern in patterns):
+            return phase
+    return None
+
+
+class StackSampler:
+    """Статистический профилировщик: периодически снимает стеки всех потоков"""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.phases: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profile-sampler")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._sample(frame)
+
+    def _sample(self, frame):
+        names = []
+        phase = None
+        leaf = frame.f_code.co_filename
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            if phase is None:
+                phase = _frame_phase(code.co_filename)
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+
+        if phase is None:
+            if leaf.endswith(IDLE_MODULES):
+                return
+            phase = "other"
+        self.samples += 1
+        self.phases[phase] += 1
+        self.stacks[";".join(reversed(names))] += 1
+
+    def report(self, duration_ms: float) -> Dict[str, Any]:
+        """
+        Возвращает фазы и свернутые стеки
+
+        Из-за GIL снимки идут реже заданного интервала, поэтому время фазы
+        оценивается как ее доля в выборке, умноженная на длительность запроса
+        """
+        phases = {}
+        for phase in [name for name, _ in PHASES] + ["other"]:
+            share = self.phases[phase] / self.samples if self.samples else 0
+            phases[phase] = {"ms": round(share * duration_ms, 2), "share": round(share, 3)}
+        return {
+            "duration_ms": round(duration_ms, 2),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "phases": phases,
+            "stacks": dict(self.stacks.most_common()),
+        }
+
+
+def check_profile_token(token: Optional[str]) -> bool:
+    """Проверяет токен администратора (при пустом PROFILE_TOKEN всегда False)"""
+    if not PROFILE_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Возвращает путь к профилю или None, если имя недопустимо или профиля нет"""
+    if not _PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{name}.json")
+    return path if os.path.isfile(path) else None
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Возвращает сводку сохраненных профилей, новые первыми"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, filename), encoding="utf-8") as file:
+                profile = json.load(file)
+        except (OSError, ValueError):
+            continue
+        profile.pop("stacks", None)
+        profiles.append(profile)
+    return profiles
+
+
+def _save_profile(profile: Dict[str, Any]):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{profile['name']}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(profile, file, ensure_ascii=False)
+
+    # Кольцевой буфер: удаляются самые старые профили сверх лимита
+    files = sorted(
+        (os.path.join(PROFILE_DIR, filename) for filename in os.listdir(PROFILE_DIR)
+         if filename.endswith(".json")),
+        key=os.path.getmtime,
+    )
+    for old in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+def _save_sampled_profile(profile: Dict[str, Any], sampler: "StackSampler", duration_ms: float):
+    """Сворачивает выборки и сохраняет профиль (выполняется в пуле потоков)"""
+    _save_profile({**profile, **sampler.report(duration_ms)})
+
+
+class ProfilingMiddleware:
+    """ASGI middleware профилирования запросов по заголовку или случайной выборке"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+
+    def _should_profile(self, scope) -> bool:
+        if scope["path"].startswith("/debug"):
+            return False
+        token = dict(scope["headers"]).get(TOKEN_HEADER)
+        if token is not None and check_profile_token(token.decode("latin-1")):
+            return True
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        if not self._lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        name = f"{datetime.now(timezone.utc):%Y%m%d-%H%M%S}-{os.getpid()}-{next(_counter)}"
+        status = None
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", name.encode())]
+            await send(message)
+
+        sampler = StackSampler()
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            # Остановка (join потока выборки), обработка выборок и запись файла
+            # не должны занимать цикл событий
+            try:
+                await run_in_threadpool(sampler.stop)
+            finally:
+                self._lock.release()
+            try:
+                await run_in_threadpool(_save_sampled_profile, {
+                    "name": name,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "status": status,
+                }, sampler, duration_ms)
+            except OSError as e:
+                print(f"Ошибка при сохранении профиля {name}: {e}")
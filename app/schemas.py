@@ -1,22 +1,35 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, create_model
+from typing import Optional, List, Tuple, Type, Dict, Any
 from datetime import datetime
+from functools import lru_cache
 
 
 class CategoryBase(BaseModel):
     title: str
 
 class CategoryCreate(CategoryBase):
-    pass
+    parent_id: Optional[int] = None
 
 class CategoryUpdate(BaseModel):
     title: Optional[str] = None
 
+class CategoryMove(BaseModel):
+    parent_id: Optional[int] = None
+
 class CategoryResponse(CategoryBase):
     id: int
+    parent_id: Optional[int] = None
     created_at: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
+class CategoryTreeNode(BaseModel):
+    category_id: int
+    title: str
+    parent_id: Optional[int] = None
+    depth: int
+    books_count: int
+    subtree_books_count: int
+
 
 class BookBase(BaseModel):
     title: str
@@ -43,4 +56,74 @@ class BookResponse(BookBase):
     model_config = ConfigDict(from_attributes=True)
 
 class CategoryWithBooksResponse(CategoryResponse):
-    books: List[BookResponse] = []
\ No newline at end of file
+    books: List[BookResponse] = []
+
+class CategoryStats(BaseModel):
+    category_id: int
+    title: str
+    books_count: int
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    avg_price: Optional[float] = None
+    median_price: Optional[float] = None
+    p90_price: Optional[float] = None
+
+class CategoryStatsResponse(BaseModel):
+    refreshed_at: Optional[datetime] = None
+    age_seconds: Optional[float] = None
+    categories: List[CategoryStats] = []
+
+
+class JobCreate(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    progress: float
+    params: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+
+def parse_book_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Разбирает параметр ?fields= для книг
+    
+    Args:
+        fields: Имена полей BookResponse через запятую
+    
+    Returns:
+        Tuple[str, ...]: Поля в порядке схемы (id всегда включен) или None, если параметр не задан
+    
+    Raises:
+        ValueError: Если указано неизвестное поле
+    """
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(BookResponse.model_fields)
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+    requested.add("id")
+    return tuple(name for name in BookResponse.model_fields if name in requested)
+
+@lru_cache(maxsize=128)
+def book_fields_schema(fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """Создает схему ответа, содержащую только указанные поля BookResponse"""
+    definitions = {
+        name: (BookResponse.model_fields[name].annotation, BookResponse.model_fields[name])
+        for name in fields
+    }
+    return create_model(
+        "BookFieldsResponse",
+        __config__=ConfigDict(from_attributes=True),
+        **definitions
+    )
@@ -0,0 +1,124 @@
+"""
+Запуск API в режиме pre-fork с несколькими воркерами
+
+Приложение app.main:app загружается один раз в мастер-процессе (preload),
+там же до fork один раз готовится схема БД (app.main.prepare_database:
+таблицы, дерево категорий, представление статистики) - иначе воркеры
+выполняли бы DDL одновременно. Затем gunicorn форкает воркеры uvicorn. Пул соединений движка сбрасывается
+в каждом воркере после fork (см. app.db.db.reset_engine_after_fork), поэтому
+сокеты родителя не разделяются между процессами.
+
+Настройки через переменные окружения:
+    HOST, PORT            - адрес и порт (по умолчанию 0.0.0.0:8000)
+    WEB_CONCURRENCY       - число воркеров (по умолчанию число CPU, но так, чтобы
+                            каждому досталось MIN_CONNECTIONS_PER_WORKER соединений)
+    DB_MAX_CONNECTIONS    - общий бюджет соединений с БД на все воркеры (по умолчанию 15)
+
+Запуск: python -m app.server
+"""
+import os
+
+from gunicorn.app.base import BaseApplication
+
+# Воркеру одновременно нужны соединения для запросов, общих чтений
+# (app.db.coalescing), фоновых задач и обновления статистики
+MIN_CONNECTIONS_PER_WORKER = 3
+
+
+def get_workers_count() -> int:
+    """Возвращает число воркеров: WEB_CONCURRENCY или число CPU"""
+    workers = os.getenv("WEB_CONCURRENCY")
+    if workers:
+        return max(1, int(workers))
+    return os.cpu_count() or 1
+
+
+def max_workers_for_budget(budget: int) -> int:
+    """Сколько воркеров получат по MIN_CONNECTIONS_PER_WORKER соединений (хотя бы один воркер)"""
+    return max(1, budget // MIN_CONNECTIONS_PER_WORKER)
+
+
+def split_connection_budget(budget: int, workers: int) -> tuple:
+    """
+    Делит общий бюджет соединений между воркерами
+
+    Args:
+        budget: Максимальное число соединений с БД на все процессы
+        workers: Число воркеров
+
+    Returns:
+        tuple: (pool_size, max_overflow) для одного воркера
+
+    Raises:
+        ValueError: Если воркеров больше, чем позволяет max_workers_for_budget
+    """
+    if workers > max_workers_for_budget(budget):
+        raise ValueError(
+            f"Бюджета {budget} соединений не хватает на {workers} воркеров "
+            f"(нужно хотя бы {MIN_CONNECTIONS_PER_WORKER} на воркер)"
+        )
+    per_worker = budget // workers
+    # Сохраняем исходное соотношение пула 5 + 10: треть постоянных соединений
+    pool_size = max(1, per_worker // 3)
+    max_overflow = per_worker - pool_size
+    return pool_size, max_overflow
+
+
+class BookstoreApplication(BaseApplication):
+    """Приложение gunicorn с preload app.main:app"""
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app.main import app
+        return app
+
+
+def main():
+    workers = get_workers_count()
+    budget = max(1, int(os.getenv("DB_MAX_CONNECTIONS", "15")))
+    max_workers = max_workers_for_budget(budget)
+    if workers > max_workers:
+        print(
+            f" Внимание: бюджета DB_MAX_CONNECTIONS={budget} хватает на {max_workers} воркеров "
+            f"по {MIN_CONNECTIONS_PER_WORKER} соединения, запрошено {workers}; запускается {max_workers}"
+        )
+        workers = max_workers
+    pool_size, max_overflow = split_connection_budget(budget, workers)
+    if pool_size + max_overflow < MIN_CONNECTIONS_PER_WORKER:
+        print(
+            f" Внимание: воркеру доступно {pool_size + max_overflow} соединений из DB_MAX_CONNECTIONS={budget}; "
+            f"фоновые задачи и запросы будут ждать друг друга"
+        )
+
+    # Должно быть задано до импорта app.db.db, который создает движок
+    os.environ["DB_POOL_SIZE"] = str(pool_size)
+    os.environ["DB_MAX_OVERFLOW"] = str(max_overflow)
+
+    # Схема готовится один раз до fork; воркеры ее только используют
+    from app.main import prepare_database
+    if prepare_database():
+        os.environ["APP_SCHEMA_READY"] = "1"
+
+    host = os.getenv("HOST", "0.0.0.0")
+    port = os.getenv("PORT", "8000")
+
+    print(f" Воркеров: {workers}, пул БД на воркер: {pool_size} + {max_overflow}")
+
+    options = {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+    }
+    BookstoreApplication(options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Пакетный расчет похожих книг
+
+Строит TF-IDF векторы по названию и описанию всех книг (разреженные
+матрицы SciPy), затем по частям перемножает их с транспонированной
+матрицей и для каждой книги сохраняет SIMILAR_BOOKS_K ближайших соседей
+в таблицу book_similarities. Эндпоинт GET /books/{id}/similar читает
+готовую строку по первичному ключу.
+
+Инкрементальный режим (по умолчанию) пересчитывает только книги,
+добавленные или измененные после начала прошлого завершенного расчета
+(таблица similarity_runs), и книги без расчета. Прерванный расчет
+отметку не сдвигает. Векторы при этом строятся по всему каталогу, но
+соседи уже посчитанных книг не обновляются: для этого нужен полный
+пересчет (--full).
+
+Слова, встречающиеся меньше чем в MIN_DF книгах или больше чем в доле
+MAX_DF каталога, в векторы не входят: первые не связывают книги между
+собой, а вторые (предлоги, "книга", "издание") делают произведение
+матриц почти плотным.
+
+Запуск: python -m app.similarity [--full]
+"""
+import math
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import delete, func, insert, or_, select
+
+from app.db.db import SessionLocal
+from app.db.models import Book, BookSimilarity, SimilarityRun
+
+SIMILAR_BOOKS_K = 20
+CHUNK_SIZE = 1000
+WRITE_BATCH_SIZE = 1000
+MIN_DF = 2
+MAX_DF = 0.5
+
+_TOKEN_RE = re.compile(r"\w{2,}")
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на слова в нижнем регистре"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def build_tfidf(texts: List[str], min_df: int = MIN_DF, max_df: float = MAX_DF) -> sparse.csr_matrix:
+    """
+    Строит TF-IDF матрицу (строки нормированы по L2)
+
+    Args:
+        texts: Тексты документов
+        min_df: Минимальное число документов со словом
+        max_df: Максимальная доля документов со словом (но не меньше min_df документов)
+
+    Returns:
+        csr_matrix: Матрица документов x термов
+    """
+    vocabulary: Dict[str, int] = {}
+    indptr = [0]
+    indices: List[int] = []
+    data: List[float] = []
+    for text in texts:
+        counts: Dict[int, int] = {}
+        for token in tokenize(text):
+            term = vocabulary.setdefault(token, len(vocabulary))
+            counts[term] = counts.get(term, 0) + 1
+        indices.extend(counts.keys())
+        data.extend(1.0 + math.log(count) for count in counts.values())
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+        shape=(len(texts), max(1, len(vocabulary))),
+    )
+
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    keep = (document_frequency >= min_df) & (document_frequency <= max(min_df, max_df * matrix.shape[0]))
+    if not keep.any():
+        return sparse.csr_matrix((len(texts), 1), dtype=np.float32)
+    matrix = matrix[:, np.nonzero(keep)[0]]
+    document_frequency = document_frequency[keep]
+    idf = np.log((1 + matrix.shape[0]) / (1 + document_frequency)) + 1
+    matrix = matrix @ sparse.diags(idf.astype(np.float32))
+
+    norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix, dtype=np.float32)
+
+
+def top_k_neighbours(
+    matrix: sparse.csr_matrix,
+    rows: np.ndarray,
+    k: int = SIMILAR_BOOKS_K,
+    chunk_size: int = CHUNK_SIZE,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Находит k ближайших по косинусному сходству строк для каждой из rows
+
+    Args:
+        matrix: Нормированная TF-IDF матрица
+        rows: Номера строк, для которых ищутся соседи
+        k: Число соседей
+        chunk_size: Сколько строк перемножается за раз
+
+    Returns:
+        List: Для каждой строки пара (номера соседей, сходство) по убыванию сходства
+    """
+    transposed = matrix.T.tocsc()
+    result = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        similarities = (matrix[chunk] @ transposed).tocsr()
+        for position, row in enumerate(chunk):
+            begin, end = similarities.indptr[position], similarities.indptr[position + 1]
+            neighbours = similarities.indices[begin:end]
+            scores = similarities.data[begin:end]
+            mask = neighbours != row
+            neighbours, scores = neighbours[mask], scores[mask]
+            if len(scores) > k:
+                best = np.argpartition(-scores, k)[:k]
+                neighbours, scores = neighbours[best], scores[best]
+            order = np.argsort(-scores, kind="stable")
+            result.append((neighbours[order], scores[order]))
+    return result
+
+
+def refresh_similar_books(
+    full: bool = False,
+    k: int = SIMILAR_BOOKS_K,
+    progress: Optional[Callable[[int, int], bool]] = None,
+) -> int:
+    """
+    Пересчитывает похожие книги и сохраняет их в book_similarities
+
+    Args:
+        full: Пересчитать все книги, а не только измененные
+        k: Число похожих книг на книгу
+        progress: Вызывается как progress(готово, всего); если вернет False, расчет прерывается
+
+    Returns:
+        int: Число пересчитанных книг
+    """
+    db = SessionLocal()
+    try:
+        started_at = datetime.now(timezone.utc)
+        ids: List[int] = []
+        texts: List[str] = []
+        for book in db.execute(
+            select(Book.id, Book.title, Book.description).order_by(Book.id)
+            .execution_options(yield_per=10000)
+        ):
+            ids.append(book.id)
+            texts.append(f"{book.title} {book.description or ''}")
+        if not ids:
+            return 0
+
+        book_ids = np.array(ids, dtype=np.int32)
+        matrix = build_tfidf(texts)
+        del ids, texts
+
+        if full:
+            rows = np.arange(len(book_ids))
+        else:
+            last_run = db.execute(select(func.max(SimilarityRun.started_at))).scalar()
+            changed = select(Book.id)
+            if last_run is not None:
+                computed = select(BookSimilarity.book_id)
+                changed = changed.where(or_(
+                    Book.created_at > last_run,
+                    Book.updated_at > last_run,
+                    Book.id.not_in(computed),
+                ))
+            changed_ids = np.array(db.execute(changed).scalars().all(), dtype=np.int32)
+            rows = np.nonzero(np.isin(book_ids, changed_ids))[0]
+
+        done = 0
+        completed = True
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            batch = rows[start:start + WRITE_BATCH_SIZE]
+            neighbours = top_k_neighbours(matrix, batch, k)
+            values = [
+                {
+                    "book_id": int(book_ids[row]),
+                    "similar_ids": book_ids[similar].astype(np.int32).tobytes(),
+                    "scores": scores.astype(np.float32).tobytes(),
+                    "computed_at": started_at,
+                }
+                for row, (similar, scores) in zip(batch, neighbours)
+            ]
+            ids = [value["book_id"] for value in values]
+            db.execute(delete(BookSimilarity).where(BookSimilarity.book_id.in_(ids)))
+            db.execute(insert(BookSimilarity), values)
+            db.commit()
+            done += len(batch)
+            if progress is not None and progress(done, len(rows)) is False:
+                completed = False
+                break
+
+        # Книги, удаленные из каталога
+        db.execute(delete(BookSimilarity).where(BookSimilarity.book_id.not_in(select(Book.id))))
+        if completed:
+            db.add(SimilarityRun(started_at=started_at, finished_at=datetime.now(timezone.utc), full=full, books=done))
+        db.commit()
+        return done
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    count = refresh_similar_books(full="--full" in sys.argv)
+    print(f"Пересчитано книг: {count} за {time.perf_counter() - started:.1f} с")
@@ -0,0 +1,149 @@
+"""
+Устаревшие ответы на время недоступности БД
+
+Middleware запоминает последние успешные ответы на GET-запросы к /books и
+/categories (ограниченный LRU-кэш в памяти процесса). Пока БД недоступна
+(DatabaseUnavailableError, см. app.db.breaker), обработчик ошибки отдает
+сохраненный ответ с заголовком Warning: 110, если ему не больше
+STALE_MAX_AGE секунд, а иначе - сразу 503 с заголовком Retry-After.
+
+Настройки через переменные окружения:
+    STALE_CACHE_SIZE        - число запоминаемых ответов (по умолчанию 500, 0 - выключено)
+    STALE_CACHE_MAX_BYTES   - максимальный размер запоминаемого ответа (по умолчанию 256 КБ)
+    STALE_MAX_AGE           - максимальный возраст отдаваемого ответа, секунды (по умолчанию 600)
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Request
+from starlette.responses import JSONResponse, Response
+
+from app.db.breaker import OPEN_SECONDS, CircuitOpenError, DatabaseUnavailableError
+
+STALE_CACHE_SIZE = int(os.getenv("STALE_CACHE_SIZE", "500"))
+STALE_CACHE_MAX_BYTES = int(os.getenv("STALE_CACHE_MAX_BYTES", str(256 * 1024)))
+STALE_MAX_AGE = float(os.getenv("STALE_MAX_AGE", "600"))
+
+CACHED_PATHS = re.compile(r"^/(books|categories)(/.*)?$")
+
+# Заголовки ответа, которые не относятся к содержимому и не сохраняются
+SKIPPED_HEADERS = {b"x-profile-id", b"retry-after", b"warning"}
+
+_CacheEntry = Tuple[float, int, List[Tuple[bytes, bytes]], bytes]
+
+
+class StaleResponseCache:
+    """Ограниченный LRU-кэш последних успешных ответов"""
+
+    def __init__(self, size: int, max_bytes: int):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.served = 0
+        self._entries: "OrderedDict[tuple, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: tuple, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), status, headers, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def get(self, key: tuple, max_age: float) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > max_age:
+                return None
+            self.served += 1
+            return entry
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "served": self.served}
+
+
+_cache = StaleResponseCache(STALE_CACHE_SIZE, STALE_CACHE_MAX_BYTES)
+
+
+def _cache_key(method: str, path: str, query: bytes, headers: Dict[bytes, bytes]) -> tuple:
+    # Тело ответа зависит от формата и сжатия, поэтому они входят в ключ
+    return (method, path, query, headers.get(b"accept", b""), headers.get(b"accept-encoding", b""))
+
+
+class StaleCacheMiddleware:
+    """ASGI middleware, запоминающий успешные ответы на GET-запросы"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or _cache.size <= 0
+            or not CACHED_PATHS.match(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        key = _cache_key("GET", scope["path"], scope.get("query_string", b""), dict(scope["headers"]))
+        start = None
+        chunks: List[bytes] = []
+        size = 0
+
+        async def send_and_remember(message):
+            nonlocal start, size
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                # Устаревшие ответы повторно не запоминаются
+                if message["status"] == 200 and not any(name == b"warning" for name, _ in headers):
+                    start = (message["status"], [h for h in headers if h[0] not in SKIPPED_HEADERS])
+            elif message["type"] == "http.response.body" and start is not None:
+                body = message.get("body", b"")
+                size += len(body)
+                if size > _cache.max_bytes:
+                    start = None
+                    chunks.clear()
+                else:
+                    chunks.append(body)
+                    if not message.get("more_body", False):
+                        _cache.put(key, start[0], start[1], b"".join(chunks))
+            await send(message)
+
+        await self.app(scope, receive, send_and_remember)
+
+
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailableError) -> Response:
+    """Обработчик DatabaseUnavailableError: устаревший ответ из кэша или 503"""
+    if not isinstance(exc, CircuitOpenError):
+        print(f"Ошибка подключения к БД: {exc}")
+    if request.method == "GET":
+        key = _cache_key("GET", request.url.path, request.scope.get("query_string", b""), dict(request.scope["headers"]))
+        entry = _cache.get(key, STALE_MAX_AGE)
+        if entry is not None:
+            stored_at, status, headers, body = entry
+            response = Response(content=body, status_code=status)
+            response.raw_headers = headers + [
+                (b"warning", b'110 - "Response is Stale"'),
+                (b"age", str(int(time.monotonic() - stored_at)).encode()),
+            ]
+            return response
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "База данных временно недоступна, повторите запрос позже"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+
+async def database_error_handler(request: Request, exc: Exception) -> Response:
+    """Обработчик ошибок подключения SQLAlchemy (OperationalError, таймаут пула)"""
+    return await database_unavailable_handler(request, DatabaseUnavailableError(str(exc), OPEN_SECONDS))
+
+
+def get_stale_cache_stats() -> Dict[str, int]:
+    """Возвращает состояние кэша устаревших ответов в текущем процессе"""
+    return _cache.stats()
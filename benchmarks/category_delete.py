@@ -0,0 +1,102 @@
+"""
+Бенчмарк удаления большой категории
+
+Сравнивает старое удаление через ORM (книги категории загружаются в
+сессию и обнуляются по одной строке) с crud.delete_category, который
+выполняет один DELETE и полагается на ondelete="SET NULL", а также
+перенос книг в другую категорию перед удалением (move_to).
+
+По умолчанию используется файл SQLite во временном каталоге; для
+PostgreSQL задайте BENCH_DATABASE_URL.
+
+Запуск: python -m benchmarks.category_delete [число книг]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app.db.crud import delete_category
+from app.db.models import Base, Book, Category
+
+
+def make_engine():
+    url = os.getenv("BENCH_DATABASE_URL")
+    if url:
+        return create_engine(url)
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    return engine
+
+
+def seed(Session, books_count: int) -> tuple:
+    """Создает категорию с books_count книгами и пустую категорию для переноса"""
+    with Session() as db:
+        source = Category(title=f"Большая категория {time.time_ns()}")
+        target = Category(title=f"Целевая категория {time.time_ns()}")
+        db.add_all([source, target])
+        db.commit()
+        batch = 10000
+        for start in range(0, books_count, batch):
+            db.execute(insert(Book), [
+                {"title": f"Книга {i}", "price": 100, "category_id": source.id}
+                for i in range(start, min(start + batch, books_count))
+            ])
+        db.commit()
+        return source.id, target.id
+
+
+def legacy_delete(db, category_id: int):
+    """Прежнее поведение: загрузка всех книг категории и db.delete()"""
+    category = db.get(Category, category_id)
+    list(category.books)
+    db.delete(category)
+    db.commit()
+
+
+def run(books_count: int):
+    engine = make_engine()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(1))
+
+    cases = [
+        ("ORM (загрузка книг)", lambda db, source, target: legacy_delete(db, source)),
+        ("delete_category", lambda db, source, target: delete_category(db, source)),
+        ("delete_category + move_to", lambda db, source, target: delete_category(db, source, target)),
+    ]
+
+    print(f"Книг в категории: {books_count}")
+    print(f"{'способ':<28} {'секунд':>10} {'SQL-запросов':>14}")
+    for name, delete in cases:
+        source, target = seed(Session, books_count)
+        statements.clear()
+        with Session() as db:
+            started = time.perf_counter()
+            delete(db, source, target)
+            elapsed = time.perf_counter() - started
+        count = len(statements)
+        with Session() as db:
+            orphaned = db.execute(
+                select(func.count()).select_from(Book).where(Book.category_id == source)
+            ).scalar()
+            assert orphaned == 0, "книги остались в удаленной категории"
+        print(f"{name:<28} {elapsed:>10.2f} {count:>14}")
+
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,171 @@
+"""
+Бенчмарк дерева категорий на глубоких деревьях
+
+Для нескольких форм дерева (длинная цепочка и широкое дерево) сравнивает:
+    - подсчет книг поддерева рекурсивным запросом по parent_id и одним
+      соединением с таблицей замыкания;
+    - выборку книг поддерева через crud.get_books_by_category(subtree=True);
+    - счетчики книг по всем категориям поддерева (crud.get_subtree_book_counts);
+    - обслуживание замыкания: перенос большого поддерева, перенос поддерева
+      из середины дерева в корень и обратно, удаление категории из середины
+      дерева (подкатегории поднимаются на уровень) и создание категории на
+      самой большой глубине.
+
+По умолчанию используется файл SQLite во временном каталоге; для
+PostgreSQL задайте BENCH_DATABASE_URL.
+
+Запуск: python -m benchmarks.category_tree [число книг]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from app.db.category_tree import rebuild_category_closure
+from app.db.crud import (
+    create_category,
+    delete_category,
+    get_books_by_category,
+    get_subtree_book_counts,
+    move_category_subtree,
+)
+from app.db.models import Base, Book, Category
+
+# (название, ветвление, глубина)
+SHAPES = [
+    ("цепочка", 1, 500),
+    ("широкое", 4, 7),
+]
+
+RECURSIVE_COUNT = """
+WITH RECURSIVE subtree (id) AS (
+    SELECT :root
+    UNION ALL
+    SELECT categories.id FROM categories JOIN subtree ON categories.parent_id = subtree.id
+)
+SELECT count(*) FROM books WHERE category_id IN (SELECT id FROM subtree)
+"""
+
+CLOSURE_COUNT = """
+SELECT count(*) FROM books
+JOIN category_closure ON category_closure.descendant_id = books.category_id
+WHERE category_closure.ancestor_id = :root
+"""
+
+
+def make_engine():
+    url = os.getenv("BENCH_DATABASE_URL")
+    if url:
+        return create_engine(url)
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    return create_engine(f"sqlite:///{path}")
+
+
+def seed(engine, Session, fanout: int, depth: int, books_count: int) -> int:
+    """Пересоздает таблицы, строит дерево и раскладывает книги по категориям; возвращает число категорий"""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    rows = [{"id": 1, "title": "Категория 1", "parent_id": None}]
+    level = [1]
+    for _ in range(depth):
+        next_level = []
+        for parent_id in level:
+            for _ in range(fanout):
+                category_id = len(rows) + 1
+                rows.append({"id": category_id, "title": f"Категория {category_id}", "parent_id": parent_id})
+                next_level.append(category_id)
+        level = next_level
+
+    with Session() as db:
+        db.execute(insert(Category), rows)
+        rebuild_category_closure(db.connection())
+        batch = 10000
+        for start in range(0, books_count, batch):
+            db.execute(insert(Book), [
+                {"title": f"Книга {i}", "price": 100, "category_id": i % len(rows) + 1}
+                for i in range(start, min(start + batch, books_count))
+            ])
+        db.commit()
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    return len(rows)
+
+
+def measure(func, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def run(books_count: int):
+    engine = make_engine()
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    for name, fanout, depth in SHAPES:
+        categories = seed(engine, Session, fanout, depth, books_count)
+        print(f"\nДерево: {name}, категорий: {categories}, глубина: {depth}, книг: {books_count}")
+        print(f"{'операция':<36} {'мс':>10}")
+
+        with engine.connect() as conn:
+            recursive = conn.execute(text(RECURSIVE_COUNT), {"root": 1}).scalar()
+            closure = conn.execute(text(CLOSURE_COUNT), {"root": 1}).scalar()
+            assert recursive == closure == books_count, (recursive, closure)
+            results = [
+                ("подсчет книг, рекурсивный запрос", measure(
+                    lambda: conn.execute(text(RECURSIVE_COUNT), {"root": 1}).scalar())),
+                ("подсчет книг, замыкание", measure(
+                    lambda: conn.execute(text(CLOSURE_COUNT), {"root": 1}).scalar())),
+            ]
+
+        with Session() as db:
+            results.append(("книги поддерева (ORM)", measure(
+                lambda: get_books_by_category(db, 1, subtree=True), repeat=3)))
+            counts = get_subtree_book_counts(db, 1)
+            assert counts[0]["subtree_books_count"] == books_count, counts[0]
+            results.append(("счетчики книг поддерева", measure(
+                lambda: get_subtree_book_counts(db, 1), repeat=3)))
+
+        # Поддерево второго уровня переносится на последний уровень соседней ветви и обратно
+        with Session() as db:
+            subtree_root = 2
+            new_parent = categories if fanout > 1 else 1
+            started = time.perf_counter()
+            moved = move_category_subtree(db, subtree_root, new_parent)
+            results.append(("перенос поддерева", time.perf_counter() - started))
+            assert moved is not None
+
+            # Поддерево из середины дерева уходит в корень и возвращается обратно
+            middle = db.execute(
+                text("SELECT descendant_id FROM category_closure WHERE ancestor_id = 1 AND depth = :depth LIMIT 1"),
+                {"depth": depth // 2},
+            ).scalar()
+            middle_parent = db.get(Category, middle).parent_id
+            started = time.perf_counter()
+            assert move_category_subtree(db, middle, None) is not None
+            assert move_category_subtree(db, middle, middle_parent) is not None
+            results.append(("перенос из середины в корень и назад", time.perf_counter() - started))
+
+            started = time.perf_counter()
+            assert delete_category(db, middle)
+            results.append(("удаление категории из середины", time.perf_counter() - started))
+
+            started = time.perf_counter()
+            create_category(db, f"Новая категория {time.time_ns()}", categories)
+            results.append(("создание категории на глубине", time.perf_counter() - started))
+
+        for operation, seconds in results:
+            print(f"{operation:<36} {seconds * 1000:>10.2f}")
+
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
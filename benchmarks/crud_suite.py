@@ -0,0 +1,330 @@
+"""
+Регрессионный бенчмарк app.db.crud
+
+Для каждого размера каталога создает одноразовую БД, заполняет ее
+книгами и вызывает каждую функцию crud. Проверяется:
+    - число SQL-запросов на вызов (лишний refresh или ленивая загрузка
+      N+1 сразу меняют это число);
+    - время вызова (медиана нескольких повторов) относительно базовой
+      линии из файла; регрессией считается рост больше порога (--threshold),
+      если он к тому же больше --min-delta-ms: для вызовов короче
+      миллисекунды относительный порог сам по себе дает ложные срабатывания;
+    - что каждая публичная функция app.db.crud покрыта хотя бы одним случаем.
+
+Обертки *_simple открывают сессию через crud.SessionLocal; на время
+прогона он подменяется фабрикой сессий тестовой БД.
+
+Код возврата 1, если есть расхождения по числу запросов, непокрытые
+функции или регрессии по времени, поэтому скрипт можно запускать в CI.
+
+По умолчанию используется файл SQLite во временном каталоге; для
+PostgreSQL задайте BENCH_DATABASE_URL (базу с таким именем не стоит
+использовать ни для чего другого: таблицы пересоздаются).
+
+Запуск:
+    python -m benchmarks.crud_suite                       сравнить с базовой линией
+    python -m benchmarks.crud_suite --update-baseline     записать базовую линию
+    python -m benchmarks.crud_suite --sizes 1000,100000 --threshold 0.3 --min-delta-ms 1
+"""
+import argparse
+import inspect
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.db import crud
+from app.db.category_tree import rebuild_category_closure
+from app.db.models import Base, Book, BookSimilarity, Category
+
+DEFAULT_SIZES = "1000,100000,1000000"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "crud_baseline.json")
+CATEGORIES_COUNT = 20
+REPEAT = 15
+BATCH_ROWS = 100
+
+
+class Case:
+    """Проверяемый вызов crud-функции"""
+
+    def __init__(
+        self,
+        name: str,
+        statements: int,
+        call: Callable[[Any, Any], Any],
+        setup: Optional[Callable[[Any], Any]] = None,
+        postgresql_only: bool = False,
+        postgresql_statements: int = 0,
+        function: Optional[str] = None,
+    ):
+        """
+        Args:
+            name: Имя случая в отчете и базовой линии
+            statements: Ожидаемое число SQL-запросов за вызов
+            call: call(db, prepared) - измеряемый вызов
+            setup: setup(db) - подготовка перед каждым повтором (не измеряется)
+            postgresql_only: Случай только для PostgreSQL
+            postgresql_statements: Разница в числе запросов на PostgreSQL (блокировка дерева категорий, пакетная вставка)
+            function: Проверяемая функция crud (по умолчанию совпадает с name)
+        """
+        self.name = name
+        self.statements = statements
+        self.call = call
+        self.setup = setup
+        self.postgresql_only = postgresql_only
+        self.postgresql_statements = postgresql_statements
+        self.function = function or name
+
+    def expected_statements(self, dialect: str) -> int:
+        """Ожидаемое число запросов для диалекта БД"""
+        return self.statements + (self.postgresql_statements if dialect == "postgresql" else 0)
+
+
+def _new_book(db) -> int:
+    return crud.create_book(db, "Временная книга", 100, category_id=1).id
+
+
+def _new_category(db) -> int:
+    return crud.create_category(db, f"Временная категория {time.time_ns()}").id
+
+
+def _new_job(db) -> int:
+    return crud.create_job(db, "export_books").id
+
+
+def _batch_rows() -> List[Dict[str, Any]]:
+    return [
+        {"title": f"Пакетная книга {i}", "price": 100, "description": None, "category_id": i % CATEGORIES_COUNT + 1,
+         "url": ""}
+        for i in range(BATCH_ROWS)
+    ]
+
+
+CASES: List[Case] = [
+    Case("create_category", 3, lambda db, _: crud.create_category(db, f"Категория {time.time_ns()}")),
+    Case("create_category_parent", 4, lambda db, _: crud.create_category(db, f"Подкатегория {time.time_ns()}", 2),
+         postgresql_statements=1, function="create_category"),
+    Case("get_category", 1, lambda db, _: crud.get_category(db, 1)),
+    Case("get_all_categories", 1, lambda db, _: crud.get_all_categories(db)),
+    Case("update_category", 3, lambda db, category_id: crud.update_category(db, category_id, f"Новое имя {time.time_ns()}"),
+         setup=_new_category),
+    Case("delete_category", 4, lambda db, category_id: crud.delete_category(db, category_id), setup=_new_category,
+         postgresql_statements=1),
+    Case("delete_category_move_to", 5, lambda db, category_id: crud.delete_category(db, category_id, move_to=1),
+         setup=_new_category, postgresql_statements=1, function="delete_category"),
+    Case("move_category_books", 1, lambda db, category_id: crud.move_category_books(db, category_id, 1),
+         setup=_new_category),
+    Case("is_in_subtree", 1, lambda db, _: crud.is_in_subtree(db, CATEGORIES_COUNT, 1)),
+    Case("move_category_subtree", 6, lambda db, category_id: crud.move_category_subtree(db, category_id, 3),
+         setup=_new_category, postgresql_statements=1),
+    Case("get_subtree_book_counts", 1, lambda db, _: crud.get_subtree_book_counts(db, 1)),
+    Case("create_book", 2, lambda db, _: crud.create_book(db, "Новая книга", 100, category_id=1)),
+    # На PostgreSQL пачка уходит одним INSERT ... RETURNING; в SQLite порядок RETURNING
+    # не гарантирован, и SQLAlchemy вставляет строки по одной
+    Case("create_books_batch", BATCH_ROWS, lambda db, rows: crud.create_books_batch(db, rows),
+         setup=lambda db: _batch_rows(), postgresql_statements=1 - BATCH_ROWS),
+    Case("get_book", 1, lambda db, _: crud.get_book(db, 1)),
+    Case("get_book_fields", 1, lambda db, _: crud.get_book(db, 1, ("id", "title", "price")), function="get_book"),
+    Case("get_all_books", 1, lambda db, _: crud.get_all_books(db)),
+    Case("get_all_books_category", 1, lambda db, _: crud.get_all_books(db, category_id=1), function="get_all_books"),
+    Case("update_book", 3, lambda db, book_id: crud.update_book(db, book_id, price=200), setup=_new_book),
+    Case("delete_book", 2, lambda db, book_id: crud.delete_book(db, book_id), setup=_new_book),
+    Case("get_books_by_category", 1, lambda db, _: crud.get_books_by_category(db, 1)),
+    Case("get_books_by_category_subtree", 1, lambda db, _: crud.get_books_by_category(db, 2, subtree=True),
+         function="get_books_by_category"),
+    Case("search_books", 1, lambda db, _: crud.search_books(db, "Книга 12345")),
+    Case("get_similar_books", 2, lambda db, _: crud.get_similar_books(db, 1)),
+    Case("get_category_stats", 1, lambda db, _: crud.get_category_stats(db), postgresql_only=True),
+    Case("count_books", 1, lambda db, _: crud.count_books(db)),
+    Case("count_books_category", 1, lambda db, _: crud.count_books(db, 1), function="count_books"),
+    Case("count_categories", 1, lambda db, _: crud.count_categories(db)),
+    Case("create_job", 2, lambda db, _: crud.create_job(db, "export_books")),
+    Case("get_job", 1, lambda db, job_id: crud.get_job(db, job_id), setup=_new_job),
+    Case("cancel_job", 3, lambda db, job_id: crud.cancel_job(db, job_id), setup=_new_job),
+    # Обертки открывают свою сессию (crud.SessionLocal); db не используется
+    Case("create_category_simple", 3, lambda db, _: crud.create_category_simple(f"Категория {time.time_ns()}")),
+    Case("get_category_simple", 1, lambda db, _: crud.get_category_simple(1)),
+    Case("get_all_categories_simple", 1, lambda db, _: crud.get_all_categories_simple()),
+    Case("update_category_simple", 3,
+         lambda db, category_id: crud.update_category_simple(category_id, f"Новое имя {time.time_ns()}"),
+         setup=_new_category),
+    Case("delete_category_simple", 4, lambda db, category_id: crud.delete_category_simple(category_id),
+         setup=_new_category, postgresql_statements=1),
+    Case("create_book_simple", 2, lambda db, _: crud.create_book_simple("Новая книга", 100, category_id=1)),
+    Case("get_book_simple", 1, lambda db, _: crud.get_book_simple(1)),
+    Case("get_all_books_simple", 1, lambda db, _: crud.get_all_books_simple()),
+    Case("update_book_simple", 3, lambda db, book_id: crud.update_book_simple(book_id, price=200), setup=_new_book),
+    Case("delete_book_simple", 2, lambda db, book_id: crud.delete_book_simple(book_id), setup=_new_book),
+    Case("get_books_by_category_simple", 1, lambda db, _: crud.get_books_by_category_simple(1)),
+    Case("search_books_simple", 1, lambda db, _: crud.search_books_simple("Книга 12345")),
+]
+
+
+def uncovered_functions() -> List[str]:
+    """Возвращает публичные функции app.db.crud, для которых нет случая"""
+    covered = {case.function for case in CASES}
+    return sorted(
+        name for name, value in vars(crud).items()
+        if inspect.isfunction(value) and value.__module__ == crud.__name__
+        and not name.startswith("_") and name not in covered
+    )
+
+
+def make_engine():
+    url = os.getenv("BENCH_DATABASE_URL")
+    if url:
+        return create_engine(url)
+    path = os.path.join(tempfile.mkdtemp(), "crud_suite.db")
+    return create_engine(f"sqlite:///{path}")
+
+
+def seed(engine, Session, books_count: int):
+    """Пересоздает таблицы и заполняет каталог"""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with Session() as db:
+        # Категории образуют двоичное дерево: у категории i родитель i // 2
+        db.execute(insert(Category), [
+            {"title": f"Категория {i}", "parent_id": i // 2 or None} for i in range(1, CATEGORIES_COUNT + 1)
+        ])
+        rebuild_category_closure(db.connection())
+        batch = 10000
+        for start in range(0, books_count, batch):
+            db.execute(insert(Book), [
+                {
+                    "title": f"Книга {i}",
+                    "description": f"Описание книги {i}",
+                    "price": 100 + i % 1000,
+                    "url": f"https://shop.example.com/books/{i}",
+                    "category_id": i % CATEGORIES_COUNT + 1,
+                }
+                for i in range(start, min(start + batch, books_count))
+            ])
+        db.execute(insert(BookSimilarity), [{
+            "book_id": 1,
+            "similar_ids": bytes(4 * 10),
+            "scores": bytes(4 * 10),
+            "computed_at": datetime.now(timezone.utc),
+        }])
+        db.commit()
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+
+def run_case(case: Case, Session, statements: list, repeat: int) -> Dict[str, float]:
+    """Выполняет случай repeat раз и возвращает медиану времени и число запросов"""
+    timings = []
+    counts = []
+    for _ in range(repeat):
+        prepared = None
+        if case.setup is not None:
+            with Session() as db:
+                prepared = case.setup(db)
+        with Session() as db:
+            statements.clear()
+            started = time.perf_counter()
+            case.call(db, prepared)
+            timings.append(time.perf_counter() - started)
+            counts.append(len(statements))
+    return {"seconds": statistics.median(timings), "statements": max(counts)}
+
+
+def run(
+    sizes: List[int],
+    baseline_path: str,
+    threshold: float,
+    update_baseline: bool,
+    min_delta_ms: float = 0.5,
+    repeat: int = REPEAT,
+) -> int:
+    engine = make_engine()
+    Session = sessionmaker(bind=engine, autoflush=False)
+    statements: list = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(1))
+    session_local = crud.SessionLocal
+    crud.SessionLocal = Session
+
+    baseline: Dict[str, Dict[str, Dict[str, float]]] = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as file:
+            baseline = json.load(file)
+    elif not update_baseline:
+        print(f"Базовая линия {baseline_path} не найдена, сравниваются только числа запросов")
+
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    failures = [f"{name}: нет случая в CASES" for name in uncovered_functions()]
+    print(f"БД: {engine.url.render_as_string(hide_password=True)}")
+    for size in sizes:
+        print(f"\nКниг: {size}")
+        seed(engine, Session, size)
+        print(f"{'функция':<30} {'запросов':>9} {'мс':>10} {'база, мс':>10} {'изменение':>10}")
+        results[str(size)] = {}
+        for case in CASES:
+            if case.postgresql_only and engine.dialect.name != "postgresql":
+                continue
+            # Списки на больших размерах дорогие, для них хватает одного повтора
+            result = run_case(case, Session, statements, repeat if size <= 100000 else 1)
+            results[str(size)][case.name] = result
+
+            base = baseline.get(str(size), {}).get(case.name)
+            change = ""
+            if base:
+                ratio = result["seconds"] / base["seconds"] - 1 if base["seconds"] else 0
+                delta_ms = (result["seconds"] - base["seconds"]) * 1000
+                change = f"{ratio * 100:+.0f}%"
+                if ratio > threshold and delta_ms > min_delta_ms:
+                    failures.append(f"{size}/{case.name}: время {change}")
+            expected = case.expected_statements(engine.dialect.name)
+            if result["statements"] != expected:
+                failures.append(
+                    f"{size}/{case.name}: запросов {result['statements']}, ожидалось {expected}"
+                )
+            print(
+                f"{case.name:<30} {result['statements']:>9} {result['seconds'] * 1000:>10.2f} "
+                f"{(base['seconds'] * 1000 if base else 0):>10.2f} {change:>10}"
+            )
+
+    crud.SessionLocal = session_local
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+    if update_baseline:
+        baseline.update(results)
+        with open(baseline_path, "w", encoding="utf-8") as file:
+            json.dump(baseline, file, ensure_ascii=False, indent=2)
+        print(f"\nБазовая линия записана в {baseline_path}")
+
+    if failures:
+        print("\nРегрессии:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\nРегрессий нет")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Регрессионный бенчмарк app.db.crud")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Размеры каталога через запятую")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Файл базовой линии")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый рост времени (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                        help="Рост времени меньше этого (мс) не считается регрессией")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Число повторов каждого случая")
+    parser.add_argument("--update-baseline", action="store_true", help="Записать результаты как базовую линию")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    sys.exit(run(sizes, args.baseline, args.threshold, args.update_baseline, args.min_delta_ms, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
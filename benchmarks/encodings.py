@@ -0,0 +1,55 @@
+"""
+Бенчмарк форматов ответа для списка книг
+
+Сравнивает размер ответа и время кодирования для JSON, колоночного JSON
+и MessagePack без сжатия и со сжатием gzip/brotli. БД не нужна: список
+книг генерируется.
+
+Запуск: python -m benchmarks.encodings [число книг]
+"""
+import sys
+import time
+from datetime import datetime, timezone
+
+from app.encoding import available_formats, compress, serialize, to_rows
+from app.schemas import BookResponse
+
+
+def make_books(count: int) -> list:
+    """Генерирует книги, похожие на реальные записи каталога"""
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": i,
+            "title": f"Книга номер {i}",
+            "description": f"Описание книги {i}: практическое руководство по программированию",
+            "price": 1000 + i % 3000 + 0.99,
+            "url": f"https://shop.example.com/books/{i}",
+            "category_id": i % 20 + 1,
+            "created_at": now,
+            "updated_at": None,
+        }
+        for i in range(count)
+    ]
+
+
+def run(count: int, repeat: int = 5):
+    rows = to_rows(make_books(count), BookResponse)
+    fields = list(BookResponse.model_fields)
+
+    print(f"Книг: {count}")
+    print(f"{'формат':<42} {'сжатие':<6} {'байт':>12} {'мс':>10}")
+    for media_type, encoding in available_formats():
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = serialize(rows, fields, media_type)
+            if encoding:
+                body = compress(body, encoding)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{media_type:<42} {encoding or '-':<6} {len(body):>12} {best * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
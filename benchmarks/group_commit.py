@@ -0,0 +1,108 @@
+"""
+Бенчмарк групповой фиксации вставок книг
+
+Запускает N одновременных вставок (как N одновременных POST /books/) и
+сравнивает пропускную способность:
+    - create_book: отдельная транзакция с commit и refresh на каждую книгу;
+    - GroupCommitter с разными окнами: пачки одной транзакцией.
+Дополнительно проверяется, что при ошибке в одной строке пачки остальные
+книги все равно создаются.
+
+По умолчанию используется файл SQLite во временном каталоге; разница
+по fsync заметна только на PostgreSQL, для него задайте BENCH_DATABASE_URL.
+
+Запуск: python -m benchmarks.group_commit [число вставок] [одновременно]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.db.crud import create_book
+from app.db.group_commit import GroupCommitter
+from app.db.models import Base, Category
+
+WINDOWS_MS = [1, 2, 5]
+
+
+def make_engine():
+    url = os.getenv("BENCH_DATABASE_URL")
+    if url:
+        return create_engine(url, pool_size=20, max_overflow=0)
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}", pool_size=20, max_overflow=0)
+
+    @event.listens_for(engine, "connect")
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    return engine
+
+
+async def run_concurrent(insert, total: int, concurrency: int) -> float:
+    """Выполняет total вставок не более чем concurrency одновременно, возвращает секунды"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            book = await insert(i)
+            assert book is not None and book.id is not None
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return time.perf_counter() - started
+
+
+async def run(total: int, concurrency: int):
+    engine = make_engine()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    with Session() as db:
+        category = Category(title="Категория")
+        db.add(category)
+        db.commit()
+        category_id = category.id
+
+    def single(i: int):
+        with Session() as db:
+            return create_book(db, f"Книга {i}", 100, category_id=category_id)
+
+    print(f"Вставок: {total}, одновременно: {concurrency}")
+    print(f"{'способ':<28} {'секунд':>8} {'вставок/с':>10} {'пачек':>7}")
+    elapsed = await run_concurrent(lambda i: run_in_threadpool(single, i), total, concurrency)
+    print(f"{'create_book':<28} {elapsed:>8.2f} {total / elapsed:>10.0f} {total:>7}")
+
+    for window in WINDOWS_MS:
+        committer = GroupCommitter(window, max_batch=concurrency, session_factory=Session)
+        elapsed = await run_concurrent(
+            lambda i: committer.submit({"title": f"Книга {i}", "price": 100, "category_id": category_id}),
+            total, concurrency
+        )
+        name = f"группами, окно {window} мс"
+        print(f"{name:<28} {elapsed:>8.2f} {total / elapsed:>10.0f} {committer.batches:>7}")
+
+    # Книга с несуществующей категорией не должна помешать остальным в пачке
+    committer = GroupCommitter(50, max_batch=100, session_factory=Session)
+    books = await asyncio.gather(
+        committer.submit({"title": "Книга", "price": 100, "category_id": category_id}),
+        committer.submit({"title": "Книга без категории", "price": 100, "category_id": -1}),
+        committer.submit({"title": "Книга", "price": 100, "category_id": category_id}),
+    )
+    assert books[0] is not None and books[1] is None and books[2] is not None, books
+    print("Ошибка одной строки не затрагивает остальные строки пачки")
+
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+    ))
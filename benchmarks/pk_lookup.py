@@ -0,0 +1,96 @@
+"""
+Микробенчмарк поиска по первичному ключу
+
+Сравнивает накладные расходы на вызов для старого варианта
+(db.query(...).filter(...).first(), запрос строится заново при каждом вызове)
+и готовых запросов из app.db.crud (get_book, get_category, get_all_books).
+
+По умолчанию используется SQLite в памяти: так измеряется в основном
+стоимость построения и компиляции запроса на стороне Python. Чтобы
+проверить PostgreSQL (в том числе DB_DRIVER=psycopg с подготовленными
+запросами на сервере), задайте BENCH_DATABASE_URL.
+
+Запуск: python -m benchmarks.pk_lookup [число вызовов]
+"""
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.crud import get_all_books, get_book, get_category
+from app.db.models import Base, Book, Category
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "sqlite://")
+
+
+def legacy_get_book(db, book_id):
+    return db.query(Book).filter(Book.id == book_id).first()
+
+
+def legacy_get_category(db, category_id):
+    return db.query(Category).filter(Category.id == category_id).first()
+
+
+def legacy_get_all_books(db):
+    return db.query(Book).order_by(Book.title).all()
+
+
+def measure(func, calls: int) -> float:
+    """Возвращает среднее время вызова в микросекундах"""
+    started = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+def run(calls: int):
+    engine = create_engine(BENCH_DATABASE_URL)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    books_count = 1000
+    with Session() as db:
+        category = Category(title="Бенчмарк")
+        db.add(category)
+        db.flush()
+        db.add_all(
+            Book(title=f"Книга {i}", price=100, category_id=category.id)
+            for i in range(books_count)
+        )
+        db.commit()
+
+    cases = [
+        ("get_book", legacy_get_book, get_book, books_count, calls),
+        ("get_category", legacy_get_category, get_category, 1, calls),
+        ("get_all_books", lambda db, _: legacy_get_all_books(db),
+         lambda db, _: get_all_books(db), 1, max(1, calls // 100)),
+    ]
+
+    print(f"БД: {engine.url.render_as_string(hide_password=True)}")
+    print(f"{'функция':<16} {'вызовов':>8} {'было, мкс':>12} {'стало, мкс':>12}")
+    for name, legacy, current, modulo, case_calls in cases:
+        with Session() as db:
+            # expunge_all: каждый вызов идет в БД, а не берет объект из identity map
+            def call_legacy(i):
+                legacy(db, i % modulo + 1)
+                db.expunge_all()
+
+            def call_current(i):
+                current(db, i % modulo + 1)
+                db.expunge_all()
+
+            call_legacy(0)
+            call_current(0)
+            before = measure(call_legacy, case_calls)
+            after = measure(call_current, case_calls)
+        print(f"{name:<16} {case_calls:>8} {before:>12.1f} {after:>12.1f}")
+
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)